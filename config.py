@@ -22,7 +22,23 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = environ.get('SQLALCHEMY_DATABASE_URI')
 
-    echo_string = environ.get('SQLALCHEMY_ECHO')
+    echo_string = environ.get('SQLALCHEMY_ECHO', 'False')
     SQLALCHEMY_ECHO = False
     if echo_string.lower().strip() == "true":
-        SQLALCHEMY_ECHO = True
\ No newline at end of file
+        SQLALCHEMY_ECHO = True
+
+    # Eager load the publisher and genres of listed games, and optionally raise on any other lazy load
+    SQLALCHEMY_EAGER_LOAD = environ.get('SQLALCHEMY_EAGER_LOAD', 'True').lower().strip() == "true"
+    SQLALCHEMY_STRICT_LOADING = environ.get('SQLALCHEMY_STRICT_LOADING', 'False').lower().strip() == "true"
+
+    # Connection pool: a pool class from sqlalchemy.pool, its size, and whether/when to check or replace connections.
+    # Unset, file and server databases use a QueuePool and in-memory SQLite keeps SQLAlchemy's default pool
+    SQLALCHEMY_POOL_CLASS = environ.get('SQLALCHEMY_POOL_CLASS')
+    SQLALCHEMY_POOL_SIZE = int(environ.get('SQLALCHEMY_POOL_SIZE', '5'))
+    SQLALCHEMY_POOL_PRE_PING = environ.get('SQLALCHEMY_POOL_PRE_PING', 'False').lower().strip() == "true"
+    SQLALCHEMY_POOL_RECYCLE = int(environ.get('SQLALCHEMY_POOL_RECYCLE', '-1'))
+
+    # SQLite tuning applied to each new connection: WAL journal, NORMAL synchronous, memory-mapped I/O and page cache
+    SQLITE_TUNING = environ.get('SQLITE_TUNING', 'True').lower().strip() == "true"
+    SQLITE_MMAP_SIZE = int(environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE = int(environ.get('SQLITE_CACHE_SIZE', '-64000'))
\ No newline at end of file
@@ -7,14 +7,13 @@ from flask import Flask
 import games.adapters.repository as repo
 
 from games.adapters import memory_repository, database_repository, repository_populate
+from games.adapters.database_engine import create_database_engine
 
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect
 
 from sqlalchemy.orm import sessionmaker, clear_mappers
 
-from sqlalchemy.pool import NullPool
-
-from games.adapters.orm import map_model_to_tables, metadata
+from games.adapters.orm import map_model_to_tables, metadata, upgrade_schema
 
 
 def create_app(test_config=None):
@@ -38,18 +37,18 @@ def create_app(test_config=None):
         repository_populate.populate(data_path, repo.repo_instance)
 
     elif app.config['REPOSITORY'] == 'database':
-        database_uri = app.config['SQLALCHEMY_DATABASE_URI']
-        database_echo = app.config['SQLALCHEMY_ECHO']
-
-        # Create the database engine.
-        database_engine = create_engine(database_uri, connect_args={"check_same_thread": False}, poolclass=NullPool,
-                                        echo=database_echo)
+        # Create the database engine, with the connection pool and SQLite tuning set in the configuration.
+        database_engine = create_database_engine(app.config)
 
         # Create the database session factory using sessionmaker.
         session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
 
         # Create the SQLAlchemy DatabaseRepository instance for a database-based repository.
-        repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
+        repo.repo_instance = database_repository.SqlAlchemyRepository(
+            session_factory,
+            eager_load=app.config.get('SQLALCHEMY_EAGER_LOAD', True),
+            strict_loading=app.config.get('SQLALCHEMY_STRICT_LOADING', False)
+        )
 
         if app.config['TESTING'] == 'True' or len(database_engine.table_names()) == 0:
             print("REPOPULATING DATABASE...")
@@ -63,15 +62,32 @@ def create_app(test_config=None):
             # Generate mappings that map domain model classes to the database tables.
             map_model_to_tables()
 
-            repository_populate.populate(data_path, repo.repo_instance)
+            # Bulk insert the data, rather than merging each object through the repository's session
+            num_rows, elapsed = repository_populate.populate_database(data_path, database_engine)
+            print(f"Inserted {num_rows} rows in {elapsed:.2f}s ({num_rows / max(elapsed, 1e-9):.0f} rows/s)")
             print("REPOPULATING DATABASE... FINISHED")
 
             app.session_factory = session_factory
 
         else:
-            # Solely generate mappings that map domain model classes to the database tables.
+            # Add any indexes or columns introduced since the database was created, then
+            # solely generate mappings that map domain model classes to the database tables.
+            upgrade_schema(database_engine)
             map_model_to_tables()
 
+        # Give each http request its own session, so objects loaded while handling one request aren't kept in the
+        # identity map for the life of the worker.
+        @app.before_request
+        def before_flask_http_request_function():
+            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+                repo.repo_instance.reset_session()
+
+        @app.teardown_appcontext
+        def shutdown_session(exception=None):
+            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+                app.logger.debug('Session identity map size: %d', repo.repo_instance.get_identity_map_size())
+                repo.repo_instance.remove_session()
+
     # Register blueprints
     with app.app_context():
         from .home import home
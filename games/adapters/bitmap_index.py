@@ -0,0 +1,74 @@
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class BitmapIndex:
+    """ A bitmap over the games in the repository for each key, such as a genre, with bit n set if the game in slot n
+    has the key.
+
+    Python ints stand in for a bit array: counting the games in a set of results with a key is a bitwise AND and a
+    popcount, each working through the bitmaps a machine word at a time.
+    """
+
+    def __init__(self):
+        # game_id -> slot, slot -> game_id (None once the game is removed), and the slots of removed games, reused
+        # so the bitmaps don't grow as games are replaced
+        self.__slots: Dict[int, int] = dict()
+        self.__game_ids: List[int | None] = list()
+        self.__free_slots: List[int] = list()
+        # key -> bitmap, and game_id -> keys of the game, so a game can be removed from its bitmaps
+        self.__bitmaps: Dict[Hashable, int] = dict()
+        self.__keys: Dict[int, Tuple[Hashable, ...]] = dict()
+
+    def __len__(self):
+        return len(self.__slots)
+
+    def __contains__(self, game_id: int):
+        return game_id in self.__slots
+
+    def add(self, game_id: int, keys: Iterable[Hashable]):
+        if game_id in self.__slots:
+            self.remove(game_id)
+
+        if self.__free_slots:
+            slot = self.__free_slots.pop()
+        else:
+            slot = len(self.__game_ids)
+            self.__game_ids.append(None)
+        self.__game_ids[slot] = game_id
+        self.__slots[game_id] = slot
+
+        keys = tuple(set(keys))
+        bit = 1 << slot
+        for key in keys:
+            self.__bitmaps[key] = self.__bitmaps.get(key, 0) | bit
+        self.__keys[game_id] = keys
+
+    def remove(self, game_id: int):
+        slot = self.__slots.pop(game_id, None)
+        if slot is None:
+            return
+
+        bit = 1 << slot
+        for key in self.__keys.pop(game_id):
+            bitmap = self.__bitmaps[key] & ~bit
+            if bitmap:
+                self.__bitmaps[key] = bitmap
+            else:
+                del self.__bitmaps[key]
+
+        self.__game_ids[slot] = None
+        self.__free_slots.append(slot)
+
+    def count(self, bitmap: int, key: Hashable) -> int:
+        """ Returns the number of games in bitmap with the key. """
+        return (bitmap & self.__bitmaps.get(key, 0)).bit_count()
+
+    def bitmap_of(self, game_ids: Iterable[int]) -> int:
+        """ Returns the bitmap of the games with the given ids, ignoring ids that aren't in the index. """
+        # Setting the bits in a byte array and converting it once avoids copying a big int for every game
+        bits = bytearray((len(self.__game_ids) + 7) // 8)
+        for game_id in game_ids:
+            slot = self.__slots.get(game_id)
+            if slot is not None:
+                bits[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(bits, 'little')
@@ -0,0 +1,62 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy import pool
+
+# Pragmas applied to every new SQLite connection when SQLITE_TUNING is on. WAL lets readers and writers work
+# concurrently, and NORMAL synchronous is safe in WAL mode while syncing far less often than FULL.
+SQLITE_TUNING_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+
+def create_database_engine(config):
+    # Create the engine described by the app's configuration, with a pool that keeps connections open between
+    # requests rather than opening a new connection for every session
+    database_uri = config['SQLALCHEMY_DATABASE_URI']
+    is_sqlite = database_uri.startswith('sqlite')
+
+    engine_options = {
+        'echo': config.get('SQLALCHEMY_ECHO', False),
+        'pool_pre_ping': config.get('SQLALCHEMY_POOL_PRE_PING', False),
+        'pool_recycle': config.get('SQLALCHEMY_POOL_RECYCLE', -1),
+    }
+
+    # An in-memory SQLite database only lives as long as its connection, so unless a pool is configured it keeps
+    # SQLAlchemy's default pool, which holds on to a single connection per thread
+    pool_class_name = config.get('SQLALCHEMY_POOL_CLASS')
+    if pool_class_name is not None or not (is_sqlite and is_sqlite_memory_uri(database_uri)):
+        pool_class_name = pool_class_name or 'QueuePool'
+        pool_class = getattr(pool, pool_class_name, None)
+        if not isinstance(pool_class, type) or not issubclass(pool_class, pool.Pool):
+            raise ValueError(f'{pool_class_name} is not an SQLAlchemy pool class')
+
+        engine_options['poolclass'] = pool_class
+        if issubclass(pool_class, (pool.QueuePool, pool.SingletonThreadPool)):
+            engine_options['pool_size'] = config.get('SQLALCHEMY_POOL_SIZE', 5)
+
+    if is_sqlite:
+        engine_options['connect_args'] = {"check_same_thread": False}
+
+    database_engine = create_engine(database_uri, **engine_options)
+
+    if is_sqlite and config.get('SQLITE_TUNING', True):
+        pragmas = dict(SQLITE_TUNING_PRAGMAS)
+        pragmas['mmap_size'] = config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+        pragmas['cache_size'] = config.get('SQLITE_CACHE_SIZE', -64000)
+        set_sqlite_pragmas_on_connect(database_engine, pragmas)
+
+    return database_engine
+
+
+def is_sqlite_memory_uri(database_uri: str) -> bool:
+    # sqlite:// with no path, sqlite:///:memory: and URI filenames opened with mode=memory
+    return database_uri in ('sqlite://', 'sqlite:///') or ':memory:' in database_uri or 'mode=memory' in database_uri
+
+
+def set_sqlite_pragmas_on_connect(database_engine, pragmas: dict):
+    @event.listens_for(database_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
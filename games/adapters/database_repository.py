@@ -1,13 +1,21 @@
 from abc import ABC
-from typing import List
+from typing import List, Tuple
 
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import scoped_session, joinedload, selectinload, raiseload
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import func, desc
-
-from games.adapters.repository import AbstractRepository
+from sqlalchemy import func, desc, or_, and_, case, select, literal_column
+from sqlalchemy.exc import IntegrityError
+
+from games.adapters.repository import (
+    AbstractRepository, RepositoryException, SearchRequest, SearchFacets, PRICE_BUCKET_BOUNDS
+)
+from games.adapters.search_index import (
+    tokenize, make_snippet, FIELD_WEIGHTS, SNIPPET_MATCH_START, SNIPPET_MATCH_END, SNIPPET_ELLIPSIS, SNIPPET_LENGTH
+)
 from games.domainmodel.model import Game, Publisher, Genre, User, Review, Wishlist
-from games.adapters.orm import favourite_games_table
+from games.adapters.orm import (
+    favourite_games_table, games_table, genres_table, game_genres_table, games_fts_table, GAMES_FTS_TABLE
+)
 
 
 class SessionContextManager:
@@ -33,32 +41,85 @@ class SessionContextManager:
 
     def reset_session(self):
         # this method can be used e.g. to allow Flask to start a new session for each http request,
-        # via the 'before_request' callback
-        self.close_current_session()
-        self.__session = scoped_session(self.__session_factory)
+        # via the 'before_request' callback. The scoped_session registry is kept, as it is shared by every thread,
+        # and only the current thread's session is discarded so the next use starts with an empty identity map
+        self.remove_current_session()
 
     def close_current_session(self):
         if not self.__session is None:
             self.__session.close()
 
+    def remove_current_session(self):
+        # Close the current thread's session and drop it from the registry, e.g. via the 'teardown_appcontext'
+        # callback at the end of each http request
+        if not self.__session is None:
+            self.__session.remove()
+
+    @property
+    def identity_map_size(self) -> int:
+        # Number of objects held by the current thread's session, without creating a session if it has none
+        if self.__session is None or not self.__session.registry.has():
+            return 0
+        return len(self.__session.identity_map)
+
 
 class SqlAlchemyRepository(AbstractRepository, ABC):
 
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, eager_load: bool = True, strict_loading: bool = False):
         self._session_cm = SessionContextManager(session_factory)
 
+        self._eager_load = eager_load
+        self._strict_loading = strict_loading
+
     def get_session(self):
         return self._session_cm.session
 
+    def _query_game_list(self):
+        # Games in a list are rendered with their publisher and genres, so load them up front. In strict mode any
+        # other lazy load raises, so N+1 query regressions show up in tests. The options are built per query as the
+        # repository can be created before the domain model is mapped.
+        options = list()
+        if self._eager_load:
+            options += [joinedload(Game._Game__publisher), selectinload(Game._Game__genres)]
+        if self._strict_loading:
+            options.append(raiseload('*'))
+
+        return self._session_cm.session.query(Game).options(*options)
+
     def close_session(self):
         self._session_cm.close_current_session()
 
     def reset_session(self):
         self._session_cm.reset_session()
 
+    def remove_session(self):
+        self._session_cm.remove_current_session()
+
+    def get_identity_map_size(self) -> int:
+        return self._session_cm.identity_map_size
+
     # region Game_data
     def get_games(self) -> List[Game]:
-        games = self._session_cm.session.query(Game).order_by(Game._Game__game_id).all()
+        games = self._query_game_list().order_by(Game._Game__game_id).all()
+        return games
+
+    def get_games_page(self, offset: int, limit: int, order_by: str = 'title') -> List[Game]:
+        if order_by == 'title':
+            ordering = (Game._Game__game_title, Game._Game__game_id)
+        elif order_by == 'game_id':
+            ordering = (Game._Game__game_id,)
+        else:
+            raise RepositoryException(f'Cannot order games by {order_by}')
+
+        games = self._query_game_list().order_by(*ordering).offset(offset).limit(limit).all()
+        return games
+
+    def get_games_after(self, title: str, game_id: int, limit: int) -> List[Game]:
+        # Seek past the last (title, game_id) seen rather than counting rows with OFFSET
+        game_title = Game._Game__game_title
+        games = self._query_game_list() \
+            .filter(or_(game_title > title, and_(game_title == title, Game._Game__game_id > game_id))) \
+            .order_by(game_title, Game._Game__game_id).limit(limit).all()
         return games
 
     def get_game(self, game_id: int) -> Game:
@@ -83,7 +144,8 @@ class SqlAlchemyRepository(AbstractRepository, ABC):
             scm.commit()
 
     def get_number_of_games(self):
-        total_games = self._session_cm.session.query(Game).count()
+        # Count the primary keys directly, rather than counting a subquery over every column
+        total_games = self._session_cm.session.query(func.count(Game._Game__game_id)).scalar()
         return total_games
 
     # endregion
@@ -113,6 +175,20 @@ class SqlAlchemyRepository(AbstractRepository, ABC):
     def get_genres(self) -> List[Genre]:
         return self._session_cm.session.query(Genre).all()
 
+    def get_genre_popularity(self, limit: int = None) -> List[Tuple[str, int]]:
+        # Count the games for every genre in the database rather than loading the games themselves
+        genre_name = genres_table.c.genre_name
+        game_count = func.count(game_genres_table.c.game_id)
+        query = self._session_cm.session.query(genre_name, game_count) \
+            .select_from(genres_table) \
+            .outerjoin(game_genres_table, game_genres_table.c.genre_name == genre_name) \
+            .group_by(genre_name).order_by(desc(game_count), genre_name)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return [(name, count) for name, count in query.all()]
+
     def add_genre(self, genre: Genre):
         with self._session_cm as scm:
             scm.session.merge(genre)
@@ -137,78 +213,332 @@ class SqlAlchemyRepository(AbstractRepository, ABC):
     def add_review(self, review: Review):
         with self._session_cm as scm:
             scm.session.add(review)
+            try:
+                scm.session.flush()
+            except IntegrityError:
+                # Discard the failed insert, which also expires the game's rating aggregates and the review
+                # collections that make_review changed
+                scm.rollback()
+                raise RepositoryException('User has already reviewed this game')
+
+            # Recount the game's ratings in the same transaction as the insert
+            self._update_rating_aggregates(review.game.game_id)
             scm.commit()
 
+    def _update_rating_aggregates(self, game_id: int):
+        # Recompute the game's rating count, sum and histogram from its reviews with one indexed GROUP BY, so
+        # concurrent reviews of the same game can't overwrite each other's running totals
+        session = self._session_cm.session
+        rating = Review._Review__rating
+        rows = session.query(rating, func.count()).filter(Review._Review__game_id == game_id).group_by(rating).all()
+
+        histogram = [0] * 6
+        for review_rating, count in rows:
+            histogram[review_rating] = count
+
+        session.query(Game).filter(Game._Game__game_id == game_id).update({
+            Game._Game__rating_count: sum(histogram),
+            Game._Game__rating_sum: sum(review_rating * count for review_rating, count in enumerate(histogram)),
+            Game._Game__rating_histogram: tuple(histogram),
+        }, synchronize_session='evaluate')
+
     def add_user(self, user: User):
         with self._session_cm as scm:
             scm.session.add(user)
             scm.commit()
 
-    def get_games_for_genre(self, genre_name: str) -> List[Game]:
-        games = self._session_cm.session.query(Game) \
-            .join(Game._Game__genres).filter(Genre._Genre__genre_name == genre_name).all()
-        return games
+    def _find_genre_name(self, genre_name: str, prefix_match: bool):
+        # Resolve the genre name case-insensitively, taking the first genre alphabetically for a prefix match
+        folded_name = func.lower(Genre._Genre__genre_name)
+        if prefix_match:
+            condition = folded_name.startswith(genre_name.lower(), autoescape=True)
+        else:
+            condition = folded_name == genre_name.lower()
+
+        row = self._session_cm.session.query(Genre._Genre__genre_name) \
+            .filter(condition).order_by(folded_name).first()
+        return row[0] if row is not None else None
+
+    def get_games_for_genre(self, genre_name: str, prefix_match: bool = True, offset: int = 0,
+                            limit: int = None) -> List[Game]:
+        name = self._find_genre_name(genre_name, prefix_match)
+        if name is None:
+            return []
+
+        query = self._query_games_for_genre_name(name)
 
+        if limit is not None:
+            query = query.offset(offset).limit(limit)
+        elif offset:
+            query = query.offset(offset)
+
+        return query.all()
+
+    def _query_games_for_genre_name(self, name: str):
+        return self._query_game_list() \
+            .join(game_genres_table, game_genres_table.c.game_id == Game._Game__game_id) \
+            .filter(game_genres_table.c.genre_name == name) \
+            .order_by(Game._Game__game_id)
 
     def get_game_from_title(self, title: str) -> Game:
-        # Perform a case-insensitive search for a game with a title that contains the provided title string
-        games = self._session_cm.session.query(Game).filter(Game._Game__game_title.ilike(f'%{title}%')).all()
+        # Perform a case-insensitive search for the first game, in title order, with a title starting with the
+        # provided title string. Return None if no matching game is found
+        games = self.get_games_from_title(title, limit=1)
+        return games[0] if games else None
 
-        if games:
-            return games[0]  # Return the first matching game
-        else:
-            return None  # Return None if no matching game is found
+    def get_games_from_title(self, title: str, limit: int = 10) -> List[Game]:
+        games = self._query_games_from_title(title).limit(limit).all()
+        return games
+
+    def _query_games_from_title(self, title: str):
+        folded_title = func.lower(Game._Game__game_title)
+        query = self._query_game_list()
+
+        prefix = title.lower()
+        if prefix:
+            # A range over lower(game_title) rather than LIKE, so SQLite can use the ix_games_game_title_lower index
+            upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            query = query.filter(folded_title >= prefix, folded_title < upper_bound)
+
+        return query.order_by(folded_title, Game._Game__game_id)
+
+    def search_games(self, query: str, limit: int = 10, offset: int = 0) -> List[Game]:
+        return [game for game, _ in self._search_games(query, limit, offset, with_snippets=False)]
+
+    def search_games_with_snippets(self, query: str, limit: int = 10, offset: int = 0) -> List[Tuple[Game, str]]:
+        return self._search_games(query, limit, offset, with_snippets=True)
+
+    def search(self, request: SearchRequest) -> List[Tuple[Game, str]]:
+        if not request.term:
+            return []
+
+        # Every query below applies the filters, so only the games in the final results are loaded
+        conditions = self._search_conditions(request)
+        results = self._search_games(request.term, request.limit, 0, with_snippets=True, conditions=conditions)
+
+        # Each kind of match is capped at title_limit, so a large publisher or genre isn't loaded in full
+        queries = list()
+        publisher_name = self._find_publisher_name(request.term)
+        if publisher_name is not None:
+            queries.append(self._query_games_for_publisher_name(publisher_name))
+        genre_name = self._find_genre_name(request.term, prefix_match=True)
+        if genre_name is not None:
+            queries.append(self._query_games_for_genre_name(genre_name))
+        queries.append(self._query_games_from_title(request.term))
+        other_matches = list()
+        for query in queries:
+            other_matches += query.filter(*conditions).limit(request.title_limit).all()
+
+        found_game_ids = {game.game_id for game, _ in results}
+        for game in other_matches:
+            if game.game_id not in found_game_ids:
+                found_game_ids.add(game.game_id)
+                results.append((game, ''))
+
+        return results
+
+    def get_search_facets(self, game_ids: List[int]) -> SearchFacets:
+        if not game_ids:
+            return SearchFacets()
+
+        session = self._session_cm.session
+        game_ids = list(set(game_ids))
+
+        genre_rows = session.execute(
+            select(game_genres_table.c.genre_name, func.count())
+            .where(game_genres_table.c.game_id.in_(game_ids))
+            .group_by(game_genres_table.c.genre_name)
+            .order_by(game_genres_table.c.genre_name)
+        ).fetchall()
+
+        publisher_rows = session.execute(
+            select(games_table.c.publisher_name, func.count())
+            .where(games_table.c.game_id.in_(game_ids), games_table.c.publisher_name.isnot(None))
+            .group_by(games_table.c.publisher_name)
+            .order_by(func.lower(games_table.c.publisher_name))
+        ).fetchall()
+
+        # Each game's price bucket is the first bound at least its price, or NULL above the last bound
+        bucket = case(*((games_table.c.game_price <= bound, bound) for bound in PRICE_BUCKET_BOUNDS), else_=None)
+        price_rows = session.execute(
+            select(bucket, func.count())
+            .where(games_table.c.game_id.in_(game_ids), games_table.c.game_price.isnot(None))
+            .group_by(bucket)
+        ).fetchall()
+        price_counts = {bound: count for bound, count in sorted(price_rows, key=lambda row: (row[0] is None, row[0]))}
+
+        return SearchFacets(dict(genre_rows), dict(publisher_rows), price_counts)
+
+    @staticmethod
+    def _search_conditions(request: SearchRequest) -> list:
+        # Conditions on the games table for each filter in the request
+        conditions = list()
+        if request.publisher is not None:
+            conditions.append(func.lower(games_table.c.publisher_name) == request.publisher.lower())
+        if request.price_max is not None:
+            conditions.append(games_table.c.game_price <= request.price_max)
+        if request.genres:
+            conditions.append(SqlAlchemyRepository._genres_condition(request.genres, request.match_all_genres))
+        return conditions
+
+    @staticmethod
+    def _genres_condition(genre_names: List[str], match_all: bool):
+        # Games with any of the genres, or, grouping their matching genres, with as many as there are genres
+        folded_names = {genre_name.lower() for genre_name in genre_names}
+        folded_genre_name = func.lower(game_genres_table.c.genre_name)
+        game_ids = select(game_genres_table.c.game_id).where(folded_genre_name.in_(folded_names))
+        if match_all:
+            game_ids = game_ids.group_by(game_genres_table.c.game_id) \
+                .having(func.count(folded_genre_name.distinct()) == len(folded_names))
+        return games_table.c.game_id.in_(game_ids)
+
+    def _search_games(self, query: str, limit: int, offset: int, with_snippets: bool,
+                      conditions: list = ()) -> List[Tuple[Game, str]]:
+        terms = tokenize(query)
+        if not terms or limit <= 0:
+            return []
+
+        session = self._session_cm.session
+        if session.get_bind().dialect.name != 'sqlite':
+            return self._search_games_by_substring(query, terms, limit, offset, with_snippets, conditions)
+
+        # Any of the words can match, ranked with FTS5's BM25 using the same field weights as the memory repository
+        fts = literal_column(GAMES_FTS_TABLE)
+        weights = [FIELD_WEIGHTS[field] for field in ('title', 'publisher', 'description')]
+        snippet = func.snippet(fts, 2, SNIPPET_MATCH_START, SNIPPET_MATCH_END, SNIPPET_ELLIPSIS, SNIPPET_LENGTH) \
+            if with_snippets else literal_column("''")
+        statement = select(games_fts_table.c.rowid, snippet) \
+            .where(fts.match(' OR '.join(f'"{term}"' for term in terms))) \
+            .order_by(func.bm25(fts, *weights), games_fts_table.c.rowid).limit(limit).offset(offset)
+        if conditions:
+            # The filters are checked for each match before ranking, so the best matches that pass them fill the limit
+            statement = statement.join_from(games_fts_table, games_table,
+                                            games_table.c.game_id == games_fts_table.c.rowid).where(*conditions)
+        rows = session.execute(statement).fetchall()
+
+        games_by_id = {game.game_id: game for game in
+                       self._query_game_list().filter(Game._Game__game_id.in_([row[0] for row in rows]))}
+        return [(games_by_id[game_id], snippet) for game_id, snippet in rows if game_id in games_by_id]
+
+    def _search_games_by_substring(self, query: str, terms: List[str], limit: int, offset: int,
+                                   with_snippets: bool, conditions: list = ()) -> List[Tuple[Game, str]]:
+        # Without FTS5, every word must appear in the title, publisher or description. Games matching a word in their
+        # title are ranked first
+        title = func.lower(Game._Game__game_title)
+        fields = (title, func.lower(Game._Game__description), func.lower(games_table.c.publisher_name))
+        term_matches = [or_(*(field.contains(term, autoescape=True) for field in fields)) for term in terms]
+        title_matches = or_(*(title.contains(term, autoescape=True) for term in terms))
+
+        games = self._query_game_list().filter(and_(*term_matches), *conditions) \
+            .order_by(case((title_matches, 0), else_=1), Game._Game__game_id).offset(offset).limit(limit).all()
+        return [(game, make_snippet(game.description, query) if with_snippets else '') for game in games]
 
     def get_games_for_publisher(self, publisher_name: str) -> List[Game]:
-        # Perform a case-insensitive search for a publisher with the given name
-        publisher_name = publisher_name.lower()
-        publisher = self._session_cm.session.query(Publisher).filter(
-            func.lower(Publisher._Publisher__publisher_name) == publisher_name).first()
-
-        if publisher is not None:
-            # Retrieve games associated with the publisher
-            games = publisher.games
-        else:
+        name = self._find_publisher_name(publisher_name)
+
+        if name is None:
             # No publisher with the given name, so return an empty list
-            games = []
+            return []
 
+        # Retrieve games associated with the publisher
+        games = self._query_games_for_publisher_name(name).all()
         return games
 
+    def _find_publisher_name(self, publisher_name: str):
+        # Perform a case-insensitive search for the first publisher whose name starts with the given name
+        folded_name = func.lower(Publisher._Publisher__publisher_name)
+        row = self._session_cm.session.query(Publisher._Publisher__publisher_name) \
+            .filter(folded_name.startswith(publisher_name.lower(), autoescape=True)) \
+            .order_by(folded_name).first()
+        return row[0] if row is not None else None
+
+    def _query_games_for_publisher_name(self, name: str):
+        return self._query_game_list() \
+            .filter(func.lower(games_table.c.publisher_name) == name.lower()) \
+            .order_by(Game._Game__game_id)
+
     def get_genre(self, genre_name: str) -> Genre:
         # Perform a case-insensitive search for a genre with the given name
         genre_name = genre_name.lower()
         genre = self._session_cm.session.query(Genre).filter(func.lower(Genre._Genre__genre_name) == genre_name).first()
         return genre
 
-    def get_num_games_for_genre(self, genre_name: str):
-        return len(self.get_games_for_genre(genre_name))
+    def get_num_games_for_genre(self, genre_name: str, prefix_match: bool = True):
+        name = self._find_genre_name(genre_name, prefix_match)
+        if name is None:
+            return 0
 
-    def get_three_most_recent_games(self) -> List[Game]:
-        games = self._session_cm.session.query(Game).order_by(desc(Game._Game__release_date)).limit(3).all()
+        # Count the genre's rows in the association table instead of loading its games
+        return self._session_cm.session.query(func.count(game_genres_table.c.game_id)) \
+            .filter(game_genres_table.c.genre_name == name).scalar()
+
+    def get_most_recent_games(self, n: int) -> List[Game]:
+        games = self._query_game_list() \
+            .order_by(desc(Game._Game__release_date), Game._Game__game_id).limit(n).all()
         return games
 
+    def get_three_most_recent_games(self) -> List[Game]:
+        return self.get_most_recent_games(3)
+
     def get_user(self, username) -> User:
         user = self._session_cm.session.query(User).filter(User._User__username == username.lower()).first()
         return user
 
+    def has_user_reviewed_game(self, user: User, game: Game) -> bool:
+        # An EXISTS over the (user_id, game_id) unique index, rather than loading the game's reviews
+        session = self._session_cm.session
+        reviews = session.query(Review).filter(Review._Review__user == user, Review._Review__game == game)
+        return session.query(reviews.exists()).scalar()
+
     def get_user_review_for_game(self, user: User, game: Game):
         review = self._session_cm.session.query(Review).filter( Review._Review__user == user, Review._Review__game == game ).first()
         return review
 
     def remove_review(self, review: Review):
         with self._session_cm as scm:
-            scm.session.delete(review)
+            game_id = review.game.game_id
+            if review in scm.session:
+                scm.session.delete(review)
+            scm.session.flush()
+
+            # Recount the game's ratings in the same transaction as the delete
+            self._update_rating_aggregates(game_id)
             scm.commit()
 
-    def get_favourites(self, user: User) -> List[Game]:
-        favourites = self._session_cm.session.query(Game).join(favourite_games_table).filter(favourite_games_table.c.username == user.username).all()
-        return favourites
+    def get_favourites(self, user: User, offset: int = 0, limit: int = None) -> List[Game]:
+        query = self._query_game_list().join(favourite_games_table) \
+            .filter(favourite_games_table.c.username == user.username) \
+            .order_by(favourite_games_table.c.position, favourite_games_table.c.game_id)
+
+        if limit is not None:
+            query = query.offset(offset).limit(limit)
+
+        return query.all()
+
+    def get_number_of_favourites(self, user: User) -> int:
+        return self._session_cm.session.query(favourite_games_table) \
+            .filter(favourite_games_table.c.username == user.username).count()
+
+    def get_reviews(self, user: User = None, offset: int = 0, limit: int = None):
+        query = self._session_cm.session.query(Review)
+        if user is not None:
+            # Served by the (user_id, time_posted) index, so only this user's reviews are read
+            query = query.filter(Review._Review__user == user) \
+                .order_by(desc(Review._Review__time_posted), desc(Review._Review__review_id))
+
+            if limit is not None:
+                query = query.offset(offset).limit(limit)
+            elif offset:
+                query = query.offset(offset)
+
+        return query.all()
 
-    def get_reviews(self, user: User):
-        return self._session_cm.session.query(Review).all()
+    def get_most_recent_review(self, user: User):
+        reviews = self.get_reviews(user, limit=1)
+        return reviews[0] if reviews else None
 
     def is_game_in_favourites(self, user: User, game: Game) -> bool:
-        return game in user.favourite_games
+        return user.has_favourite_game(game)
 
     def remove_game_from_favourites(self, user: User, game: Game):
         with self._session_cm as scm:
@@ -3,35 +3,173 @@ from abc import ABC
 from datetime import datetime
 from pathlib import Path
 
-from typing import List
-from bisect import insort_left
+from typing import Callable, Iterable, Iterator, List, Tuple
+from bisect import bisect_left, bisect_right, insort_left
+from itertools import islice
 
 from games.adapters.datareader.csvdatareader import GameFileCSVReader
-from games.adapters.repository import AbstractRepository, RepositoryException
-from games.domainmodel.model import Game, Genre, Publisher, User, Review, make_review
+from games.adapters.repository import (
+    AbstractRepository, RepositoryException, SearchRequest, SearchFacets, PRICE_BUCKET_BOUNDS, price_bucket
+)
+from games.adapters.bitmap_index import BitmapIndex
+from games.adapters.search_index import SearchIndex, make_snippet
+from games.domainmodel.model import Game, Genre, Publisher, User, Review, make_review, delete_review
 
 from werkzeug.security import generate_password_hash
 
 
+def release_date_key(game: Game):
+    # Parse the release date once, when the game is indexed. Ties are broken by id, oldest game first
+    ordinal = datetime.strptime(game.release_date, "%b %d, %Y").toordinal()
+    return -ordinal, game.game_id
+
+
 class MemoryRepository(AbstractRepository, ABC):
     def __init__(self):
         self.__games = list()
+        # Hash index from game_id to Game, kept in sync with the id-sorted list above
+        self.__games_by_id = dict()
+        # (lower-cased title, game_id) pairs kept sorted for prefix searches on titles
+        self.__title_index = list()
+        # (title, game_id) pairs kept sorted for browsing games in alphabetical order
+        self.__title_order = list()
+        # (negated release date ordinal, game_id) pairs kept sorted so the most recent games come first
+        self.__release_date_index = list()
         self.__genres = list()
+        # Genre lookups: exact name, and case-folded names kept sorted for prefix lookups
+        self.__genres_by_name = dict()
+        self.__folded_genre_names = list()
+        # Inverted index from genre name to an id-ordered posting list of Games
+        self.__games_by_genre = dict()
+        # (genre_name, number of games) pairs ranked by popularity, rebuilt lazily after the genre counts change
+        self.__genre_popularity = None
+        # Dictionary from lower-cased genre name to a bit number, and each game's genres as a mask of those bits
+        self.__genre_bits = dict()
+        self.__genre_masks = dict()
+        # Bitmaps over all games for each ('genre', lower-cased genre name), ('publisher', lower-cased publisher name)
+        # and ('price', price bucket), for counting search facets
+        self.__facet_bitmaps = BitmapIndex()
         self.__publishers = list()
-        self.__users = list()
+        # Publisher lookups by lower-cased name, with the names kept sorted for prefix lookups
+        self.__publishers_by_folded_name = dict()
+        self.__folded_publisher_names = list()
+        # Sorted game ids for each lower-cased publisher name
+        self.__game_ids_by_publisher = dict()
+        # Users keyed by their (lower-cased) username
+        self.__users = dict()
         self.__reviews = list()
+        # Reviews for each username in the order they were added, and the review for each (username, game_id) pair
+        self.__reviews_by_user = dict()
+        self.__reviews_by_user_and_game = dict()
+        # Full-text index over the title, publisher and description of each game
+        self.__search_index = SearchIndex()
 
     def add_game(self, game: Game):
         if isinstance(game, Game):
+            # Replace any existing game with the same id so the list and the id index never disagree
+            if game.game_id in self.__games_by_id:
+                self.remove_game(self.__games_by_id[game.game_id])
+
             # Keep game list sorted alphabetically by id when inserting game
             # Games will be sorted by game_id due to __lt__ method of the Game class
             insort_left(self.__games, game)
+            self.__games_by_id[game.game_id] = game
+
+            if game.title is not None:
+                insort_left(self.__title_index, (game.title.lower(), game.game_id))
+                insort_left(self.__title_order, (game.title, game.game_id))
+
+            if game.release_date is not None:
+                insort_left(self.__release_date_index, release_date_key(game))
+
+            for genre in game.genres:
+                insort_left(self.__games_by_genre.setdefault(genre.genre_name, list()), game)
+            self.__genre_popularity = None
+
+            folded_genre_names = [genre.genre_name.lower() for genre in game.genres if genre.genre_name is not None]
+            genre_mask = 0
+            for folded_name in folded_genre_names:
+                genre_mask |= 1 << self.__get_genre_bit(folded_name)
+            self.__genre_masks[game.game_id] = genre_mask
+
+            facet_keys = [('genre', folded_name) for folded_name in folded_genre_names]
+            if game.publisher is not None and game.publisher.publisher_name is not None:
+                facet_keys.append(('publisher', game.publisher.publisher_name.lower()))
+            if game.price is not None:
+                facet_keys.append(('price', price_bucket(game.price)))
+            self.__facet_bitmaps.add(game.game_id, facet_keys)
+
+            if game.publisher is not None and game.publisher.publisher_name is not None:
+                folded_name = game.publisher.publisher_name.lower()
+                insort_left(self.__game_ids_by_publisher.setdefault(folded_name, list()), game.game_id)
+
+            self.__search_index.add_game(game)
+
+    def remove_game(self, game: Game):
+        if isinstance(game, Game) and game.game_id in self.__games_by_id:
+            stored_game = self.__games_by_id.pop(game.game_id)
+            self.__search_index.remove_game(stored_game.game_id)
+
+            # The list is sorted by id, so the stored game can be found with a binary search
+            idx = bisect_left(self.__games, stored_game)
+            if idx < len(self.__games) and self.__games[idx] is stored_game:
+                del self.__games[idx]
+
+            if stored_game.title is not None:
+                title_key = (stored_game.title.lower(), stored_game.game_id)
+                idx = bisect_left(self.__title_index, title_key)
+                if idx < len(self.__title_index) and self.__title_index[idx] == title_key:
+                    del self.__title_index[idx]
+
+                title_key = (stored_game.title, stored_game.game_id)
+                idx = bisect_left(self.__title_order, title_key)
+                if idx < len(self.__title_order) and self.__title_order[idx] == title_key:
+                    del self.__title_order[idx]
+
+            if stored_game.release_date is not None:
+                release_key = release_date_key(stored_game)
+                idx = bisect_left(self.__release_date_index, release_key)
+                if idx < len(self.__release_date_index) and self.__release_date_index[idx] == release_key:
+                    del self.__release_date_index[idx]
+
+            for genre in stored_game.genres:
+                posting_list = self.__games_by_genre.get(genre.genre_name, list())
+                idx = bisect_left(posting_list, stored_game)
+                if idx < len(posting_list) and posting_list[idx] is stored_game:
+                    del posting_list[idx]
+            self.__genre_popularity = None
+            self.__genre_masks.pop(stored_game.game_id, None)
+            self.__facet_bitmaps.remove(stored_game.game_id)
+
+            if stored_game.publisher is not None and stored_game.publisher.publisher_name is not None:
+                game_ids = self.__game_ids_by_publisher.get(stored_game.publisher.publisher_name.lower(), list())
+                idx = bisect_left(game_ids, stored_game.game_id)
+                if idx < len(game_ids) and game_ids[idx] == stored_game.game_id:
+                    del game_ids[idx]
 
     def get_game(self, game_id: int) -> Game | None:
-        return next((g for g in self.__games if g.game_id == game_id), None)
+        try:
+            return self.__games_by_id.get(game_id)
+        except TypeError:
+            # Unhashable ids can never match a game
+            return None
 
     def get_games(self) -> List[Game]:
-        return self.__games
+        # A copy, so callers sorting the list can't reorder the id-ordered index
+        return list(self.__games)
+
+    def get_games_page(self, offset: int, limit: int, order_by: str = 'title') -> List[Game]:
+        if order_by == 'title':
+            # Only the requested slice of the title ordering is resolved to Games
+            return [self.__games_by_id[game_id] for _, game_id in self.__title_order[offset:offset + limit]]
+        elif order_by == 'game_id':
+            return self.__games[offset:offset + limit]
+
+        raise RepositoryException(f'Cannot order games by {order_by}')
+
+    def get_games_after(self, title: str, game_id: int, limit: int) -> List[Game]:
+        start = bisect_right(self.__title_order, (title, game_id))
+        return [self.__games_by_id[game_id] for _, game_id in self.__title_order[start:start + limit]]
 
     def get_number_of_games(self):
         return len(self.__games)
@@ -40,14 +178,59 @@ class MemoryRepository(AbstractRepository, ABC):
         if isinstance(genre, Genre):
             insort_left(self.__genres, genre)
 
+            if genre.genre_name is not None and genre.genre_name not in self.__genres_by_name:
+                self.__genres_by_name[genre.genre_name] = genre
+                insort_left(self.__folded_genre_names, (genre.genre_name.lower(), genre.genre_name))
+                self.__genre_popularity = None
+                self.__get_genre_bit(genre.genre_name.lower())
+
+    def __get_genre_bit(self, folded_name: str) -> int:
+        # Genres are numbered in the order they're first seen, which is when the catalogue is populated
+        bit = self.__genre_bits.get(folded_name)
+        if bit is None:
+            bit = len(self.__genre_bits)
+            self.__genre_bits[folded_name] = bit
+        return bit
+
+    def __get_genre_mask(self, genre_names: Iterable[str]) -> int | None:
+        # Mask of the named genres, or None if any of them isn't a genre
+        genre_mask = 0
+        for genre_name in genre_names:
+            bit = self.__genre_bits.get(genre_name.lower())
+            if bit is None:
+                return None
+            genre_mask |= 1 << bit
+        return genre_mask
+
     def get_genres(self) -> List[Genre]:
         return self.__genres
 
+    def get_genre_popularity(self, limit: int = None) -> List[Tuple[str, int]]:
+        if self.__genre_popularity is None:
+            # The number of games for each genre is the length of its posting list
+            genre_counts = [(name, len(self.__games_by_genre.get(name, list()))) for name in self.__genres_by_name]
+            genre_counts.sort(key=lambda genre_count: (-genre_count[1], genre_count[0]))
+            self.__genre_popularity = genre_counts
+
+        return self.__genre_popularity[0:limit]
+
     def get_publishers(self) -> List[Publisher]:
         return self.__publishers
 
     def get_genre(self, genre_name: str) -> Genre:
-        return next((g for g in self.__genres if g.genre_name == genre_name), None)
+        return self.__genres_by_name.get(genre_name)
+
+    def __find_genre_name(self, genre_name: str, prefix_match: bool) -> str | None:
+        # Binary search over the case-folded names; the first name at or after the search key is the only candidate
+        folded_name = genre_name.lower()
+        idx = bisect_left(self.__folded_genre_names, (folded_name,))
+
+        if idx < len(self.__folded_genre_names):
+            candidate_folded, candidate_name = self.__folded_genre_names[idx]
+            if candidate_folded == folded_name or (prefix_match and candidate_folded.startswith(folded_name)):
+                return candidate_name
+
+        return None
 
     def add_publisher(self, publisher: Publisher):
         if isinstance(publisher, Publisher):
@@ -55,98 +238,234 @@ class MemoryRepository(AbstractRepository, ABC):
             # Games will be sorted by game_id due to __lt__ method of the Game class
             insort_left(self.__publishers, publisher)
 
+            if publisher.publisher_name is not None:
+                folded_name = publisher.publisher_name.lower()
+                if folded_name not in self.__publishers_by_folded_name:
+                    self.__publishers_by_folded_name[folded_name] = publisher
+                    insort_left(self.__folded_publisher_names, folded_name)
+
     def get_publisher(self, publisher_name: str) -> Publisher:
-        return next((p for p in self.__publishers if p.publisher_name.lower() == publisher_name.lower()), None)
+        return self.__publishers_by_folded_name.get(publisher_name.lower())
 
     # Search methods
-    def get_games_for_genre(self, genre_name: str) -> List[Game]:
-        # Linear search to find the first occurrence of a Genre with the name genre_name
-        genre = next((g for g in self.__genres if g.genre_name.lower().startswith(genre_name.lower())), None)
-
-        def has_genre(game: Game):
-            if genre in game.genres:
-                return True
+    def get_games_for_genre(self, genre_name: str, prefix_match: bool = True, offset: int = 0,
+                            limit: int = None) -> List[Game]:
+        name = self.__find_genre_name(genre_name, prefix_match)
 
-            return False
+        # No Genre with given genre_name, so return an empty list
+        if name is None:
+            return list()
 
-        # Return a list of the ids of games associated with the genre
-        if genre is not None:
-            games = list(filter(has_genre, self.__games))
-        else:
-            # No Genre with given genre_name, so return an empty list
-            games = list()
+        # Slicing copies the posting list, so callers can't reorder the index
+        posting_list = self.__games_by_genre.get(name, list())
+        if limit is None:
+            return posting_list[offset:]
 
-        return games
+        return posting_list[offset:offset + limit]
 
     def get_games_for_publisher(self, publisher_name: str) -> List[Game]:
-        # Linear search to find the first occurrence of a Publisher with the given publisher_name
-        publisher = next((p for p in self.__publishers if p.publisher_name.lower().startswith(publisher_name.lower())),
-                         None)
+        return list(self.__iter_games_for_publisher(publisher_name))
 
-        def has_publisher(game: Game):
-            if game.publisher is publisher:
-                return True
+    def __iter_games_for_publisher(self, publisher_name: str) -> Iterator[Game]:
+        # Binary search for the first Publisher whose lower-cased name starts with publisher_name
+        folded_name = publisher_name.lower()
+        idx = bisect_left(self.__folded_publisher_names, folded_name)
 
-            return False
+        if idx == len(self.__folded_publisher_names) or \
+                not self.__folded_publisher_names[idx].startswith(folded_name):
+            # No publisher with given publisher_name
+            return
 
-        # Return a list of the ids of games associated with the publisher
-        if publisher is not None:
-            games = list(filter(has_publisher, self.__games))
-        else:
-            # No publisher with given publisher_name, so return an empty list
-            games = list()
+        # The games associated with the publisher, ordered by id
+        game_ids = self.__game_ids_by_publisher.get(self.__folded_publisher_names[idx], list())
+        yield from map(self.__games_by_id.__getitem__, game_ids)
 
-        return games
+    def get_games_from_title(self, title: str, limit: int = 10) -> List[Game]:
+        return list(islice(self.__iter_games_from_title(title), limit))
 
-    def get_game_from_title(self, title: str) -> Game:
-        # Linear search to find the first occurrence of a Game with the given title
-        game = next((g for g in self.__games if g.title.lower().startswith(title.lower())), None)
-
-        return game
+    def __iter_games_from_title(self, title: str) -> Iterator[Game]:
+        # Binary search for the first title with the given prefix, matches are then contiguous in the index
+        folded_title = title.lower()
+        idx = bisect_left(self.__title_index, (folded_title,))
 
-    def get_num_games_for_genre(self, genre_name: str):
-        return len(self.get_games_for_genre(genre_name))
+        while idx < len(self.__title_index):
+            candidate_title, game_id = self.__title_index[idx]
+            if not candidate_title.startswith(folded_title):
+                break
 
-    def get_three_most_recent_games(self) -> List[Game]:
-        games = list()
+            yield self.__games_by_id[game_id]
+            idx += 1
 
-        if len(self.__games) > 0:
-            # Sort games by release_date (most recent), then slice & return the first 3
-            games = self.__games
-            games.sort(key=lambda g: datetime.strptime(g.release_date, "%b %d, %Y"), reverse=True)
-            return games[0:3]
+    def get_game_from_title(self, title: str) -> Game:
+        games = self.get_games_from_title(title, limit=1)
+
+        return games[0] if games else None
+
+    def get_num_games_for_genre(self, genre_name: str, prefix_match: bool = True):
+        name = self.__find_genre_name(genre_name, prefix_match)
+
+        if name is None:
+            return 0
+
+        return len(self.__games_by_genre.get(name, list()))
+
+    def get_most_recent_games(self, n: int) -> List[Game]:
+        # The release date index is already ordered by most recent, so only the first n entries are read
+        return [self.__games_by_id[game_id] for _, game_id in self.__release_date_index[0:n]]
+
+    def search_games(self, query: str, limit: int = 10, offset: int = 0) -> List[Game]:
+        results = self.__search_index.search(query, offset + limit)[offset:]
+        return [self.__games_by_id[game_id] for game_id, _ in results]
+
+    def search_games_with_snippets(self, query: str, limit: int = 10, offset: int = 0) -> List[Tuple[Game, str]]:
+        return [(game, make_snippet(game.description, query)) for game in self.search_games(query, limit, offset)]
+
+    def search(self, request: SearchRequest) -> List[Tuple[Game, str]]:
+        if not request.term:
+            return list()
+
+        accepts = self.__search_filter(request)
+        games_by_id = self.__games_by_id
+
+        # The filters are checked as the full-text index is read, so the best matches that pass them fill the limit
+        ranked = self.__search_index.search(request.term, request.limit,
+                                            accept=lambda game_id: accepts(games_by_id[game_id]))
+        results = [(games_by_id[game_id], make_snippet(games_by_id[game_id].description, request.term))
+                   for game_id, _ in ranked]
+
+        found_game_ids = {game.game_id for game, _ in results}
+        # Each kind of match is read lazily and capped at title_limit, so a large publisher or genre isn't copied
+        genre_name = self.__find_genre_name(request.term, prefix_match=True)
+        for games in (self.__iter_games_for_publisher(request.term), self.__games_by_genre.get(genre_name, ()),
+                      self.__iter_games_from_title(request.term)):
+            for game in islice(filter(accepts, games), request.title_limit):
+                if game.game_id not in found_game_ids:
+                    found_game_ids.add(game.game_id)
+                    results.append((game, ''))
+
+        return results
+
+    def get_search_facets(self, game_ids: List[int]) -> SearchFacets:
+        facet_bitmaps = self.__facet_bitmaps
+        results = facet_bitmaps.bitmap_of(game_ids)
+
+        # Every genre is counted, but only the publishers of the results, as there are many more publishers
+        genre_counts = dict()
+        for folded_name, genre_name in self.__folded_genre_names:
+            count = facet_bitmaps.count(results, ('genre', folded_name))
+            if count:
+                genre_counts[genre_name] = count
+
+        publisher_names = {game.publisher.publisher_name.lower(): game.publisher.publisher_name
+                           for game in map(self.__games_by_id.get, game_ids)
+                           if game is not None and game.publisher is not None and
+                           game.publisher.publisher_name is not None}
+        publisher_counts = {publisher_name: facet_bitmaps.count(results, ('publisher', folded_name))
+                            for folded_name, publisher_name in sorted(publisher_names.items())}
+
+        price_counts = dict()
+        for bound in PRICE_BUCKET_BOUNDS + (None,):
+            count = facet_bitmaps.count(results, ('price', bound))
+            if count:
+                price_counts[bound] = count
+
+        return SearchFacets(genre_counts, publisher_counts, price_counts)
+
+    def __search_filter(self, request: SearchRequest) -> Callable[[Game], bool]:
+        publisher_name = request.publisher.lower() if request.publisher is not None else None
+        price_max = request.price_max
+
+        # Genres are checked against each game's genre mask, ignoring unknown genres unless all must match
+        genre_mask = 0
+        if request.genres:
+            genre_mask = self.__get_genre_mask(request.genres)
+            if genre_mask is None:
+                if request.match_all_genres:
+                    return lambda game: False
+                genre_mask = self.__get_genre_mask(genre_name for genre_name in request.genres
+                                                   if genre_name.lower() in self.__genre_bits)
+                if not genre_mask:
+                    return lambda game: False
+        required_mask = genre_mask if request.match_all_genres else 0
+        genre_masks = self.__genre_masks
+
+        def accepts(game: Game) -> bool:
+            if publisher_name is not None and (game.publisher is None or game.publisher.publisher_name is None or
+                                               game.publisher.publisher_name.lower() != publisher_name):
+                return False
+            if price_max is not None and game.price > price_max:
+                return False
+            if genre_mask:
+                game_mask = genre_masks.get(game.game_id, 0)
+                if game_mask & genre_mask == 0 or game_mask & required_mask != required_mask:
+                    return False
+            return True
+
+        return accepts
 
-        # Return an empty list if there are no games
-        return games
+    def get_three_most_recent_games(self) -> List[Game]:
+        return self.get_most_recent_games(3)
 
     def add_user(self, user: User):
         if isinstance(user, User):
-            self.__users.append(user)
+            self.__users[user.username] = user
 
     def get_user(self, username) -> User:
-        return next((u for u in self.__users if u.username == username.lower()), None)
+        return self.__users.get(username.lower())
 
     def add_review(self, review: Review):
         # call parent class first, add_review relies on implementation of code common to all derived classes
         super().add_review(review)
+        key = (review.user.username, review.game.game_id)
+        existing_review = self.__reviews_by_user_and_game.get(key, review)
+        if existing_review is not review:
+            # make_review has already attached the duplicate to the game and user, so detach it again to leave the
+            # game's rating aggregates as they were. A duplicate equal to the existing review was never attached
+            if review != existing_review:
+                delete_review(review)
+            raise RepositoryException('User has already reviewed this game')
+
         self.__reviews.append(review)
 
+        self.__reviews_by_user.setdefault(review.user.username, list()).append(review)
+        self.__reviews_by_user_and_game[key] = review
+
+    def has_user_reviewed_game(self, user: User, game: Game) -> bool:
+        return (user.username, game.game_id) in self.__reviews_by_user_and_game
+
     def get_user_review_for_game(self, user: User, game: Game):
-        # Linear search to find the first occurrence of a Review in the user reviews associated with the given game
-        review = next((r for r in self.__reviews if r.game == game and r.user == user), None)
+        return self.__reviews_by_user_and_game.get((user.username, game.game_id))
+
+    def get_reviews(self, user: User = None, offset: int = 0, limit: int = None):
+        if user is None:
+            return self.__reviews
 
-        return review
+        # Reviews are appended as they are posted, so reversing gives the most recent review first
+        user_reviews = list(reversed(self.__reviews_by_user.get(user.username, list())))
+        if limit is None:
+            return user_reviews[offset:]
 
-    def get_reviews(self, user: User):
-        return self.__reviews
+        return user_reviews[offset:offset + limit]
+
+    def get_most_recent_review(self, user: User):
+        user_reviews = self.__reviews_by_user.get(user.username)
+        return user_reviews[-1] if user_reviews else None
 
     def remove_review(self, review: Review):
         self.__reviews.remove(review)
 
+        user_reviews = self.__reviews_by_user.get(review.user.username, list())
+        if review in user_reviews:
+            user_reviews.remove(review)
+
+        key = (review.user.username, review.game.game_id)
+        if self.__reviews_by_user_and_game.get(key) is review:
+            del self.__reviews_by_user_and_game[key]
+
     # Helper to check if a game is in the user's favourites already
     def is_game_in_favourites(self, user: User, game: Game) -> bool:
         if isinstance(user, User) and isinstance(game, Game):
-            return game in user.favourite_games
+            return user.has_favourite_game(game)
 
         return False
 
@@ -167,8 +486,14 @@ class MemoryRepository(AbstractRepository, ABC):
         for genre in genres:
             self.add_genre(genre)
 
-    def get_favourites(self, user: User):
-        return user.favourite_games
+    def get_favourites(self, user: User, offset: int = 0, limit: int = None):
+        if limit is None:
+            return user.favourite_games
+
+        return user.get_favourite_games_page(offset, limit)
+
+    def get_number_of_favourites(self, user: User) -> int:
+        return user.number_of_favourite_games
 
     def add_multiple_publishers(self, publisher: List[Publisher]):
         for p in publisher:
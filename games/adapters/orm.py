@@ -1,13 +1,54 @@
+from datetime import datetime
+
 from sqlalchemy import (
-    Table, MetaData, Column, Integer, String, Text, Float, ForeignKey, DateTime, PrimaryKeyConstraint
+    Table, MetaData, Column, Integer, String, Text, Float, ForeignKey, DateTime, PrimaryKeyConstraint, JSON, Index,
+    Date, TypeDecorator, DDL, event, func, inspect, select, type_coerce, table, column, text
 )
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import mapper, relationship, synonym
+from sqlalchemy.orm.collections import attribute_mapped_collection
 
 from games.domainmodel.model import Game, Publisher, Genre, User, Review, Wishlist
 
 # global variable giving access to the MetaData (schema) information of the database
 metadata = MetaData()
 
+RELEASE_DATE_FORMAT = "%b %d, %Y"
+REVIEW_TIME_FORMAT = "%b %d, %Y at %H:%M:%S"
+
+
+class ReleaseDate(TypeDecorator):
+    # Stores the domain model's "Oct 21, 2008" release date strings as real dates, so they sort chronologically
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return datetime.strptime(value, RELEASE_DATE_FORMAT).date()
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return f'{value:%b} {value.day}, {value.year}'
+
+
+class ReviewTimestamp(TypeDecorator):
+    # Stores the domain model's "Oct 21, 2008 at 13:05:09" review times as real timestamps, so they sort
+    # chronologically
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return datetime.strptime(value, REVIEW_TIME_FORMAT)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return value.strftime(REVIEW_TIME_FORMAT)
+
 publishers_table = Table(
     'publishers', metadata,
     # We only want to maintain those attributes that are in our domain model
@@ -18,14 +59,51 @@ publishers_table = Table(
 games_table = Table(
     'games', metadata,
     Column('game_id', Integer, primary_key=True),
-    Column('game_title', Text, nullable=False),
+    Column('game_title', Text, nullable=False, index=True),
     Column('game_price', Float, nullable=False),
-    Column('release_date', String(10), nullable=False),
+    Column('release_date', ReleaseDate, nullable=False, index=True),
     Column('game_description', String(255), nullable=True),
     Column('game_image_url', String(255), nullable=True),
     Column('game_website_url', String(255), nullable=True),
-    Column('publisher_name', ForeignKey('publishers.name'))
+    Column('publisher_name', ForeignKey('publishers.name'), index=True),
+    # Running aggregates over the game's reviews, kept up to date by the domain model
+    Column('rating_count', Integer, nullable=False, default=0, server_default='0'),
+    Column('rating_sum', Integer, nullable=False, default=0, server_default='0'),
+    Column('rating_histogram', JSON, nullable=False, default=[0] * 6, server_default='[0, 0, 0, 0, 0, 0]')
 )
+# Case-insensitive title lookups and ordering go through lower(game_title)
+Index('ix_games_game_title_lower', func.lower(games_table.c.game_title))
+
+# In SQLite, an FTS5 index over the title, publisher and description of each game backs search. It reads the text from
+# the games table (external content), and triggers keep it in sync as games are inserted, updated and deleted
+GAMES_FTS_TABLE = 'games_fts'
+# The virtual table isn't part of the metadata, this lets queries join it to games by rowid
+games_fts_table = table(GAMES_FTS_TABLE, column('rowid'))
+_games_fts_columns = 'game_title, publisher_name, game_description'
+GAMES_FTS_TRIGGERS = {
+    'games_fts_after_insert':
+        f"CREATE TRIGGER games_fts_after_insert AFTER INSERT ON games BEGIN "
+        f"INSERT INTO {GAMES_FTS_TABLE}(rowid, {_games_fts_columns}) "
+        f"VALUES (new.game_id, new.game_title, new.publisher_name, new.game_description); END",
+    'games_fts_after_delete':
+        f"CREATE TRIGGER games_fts_after_delete AFTER DELETE ON games BEGIN "
+        f"INSERT INTO {GAMES_FTS_TABLE}({GAMES_FTS_TABLE}, rowid, {_games_fts_columns}) "
+        f"VALUES ('delete', old.game_id, old.game_title, old.publisher_name, old.game_description); END",
+    'games_fts_after_update':
+        f"CREATE TRIGGER games_fts_after_update AFTER UPDATE OF {_games_fts_columns} ON games BEGIN "
+        f"INSERT INTO {GAMES_FTS_TABLE}({GAMES_FTS_TABLE}, rowid, {_games_fts_columns}) "
+        f"VALUES ('delete', old.game_id, old.game_title, old.publisher_name, old.game_description); "
+        f"INSERT INTO {GAMES_FTS_TABLE}(rowid, {_games_fts_columns}) "
+        f"VALUES (new.game_id, new.game_title, new.publisher_name, new.game_description); END",
+}
+GAMES_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE {GAMES_FTS_TABLE} USING fts5({_games_fts_columns}, content='games', "
+    f"content_rowid='game_id')",
+    *GAMES_FTS_TRIGGERS.values(),
+]
+for statement in GAMES_FTS_DDL:
+    event.listen(games_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(games_table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {GAMES_FTS_TABLE}').execute_if(dialect='sqlite'))
 
 genres_table = Table(
     'genres', metadata,
@@ -35,33 +113,187 @@ genres_table = Table(
 game_genres_table = Table(
     'games_genres', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('game_id', ForeignKey('games.game_id')),
+    Column('game_id', ForeignKey('games.game_id'), index=True),
     Column('genre_name', ForeignKey('genres.genre_name'))
 )
+# Games for a genre are filtered by genre name and ordered by game id
+Index('ix_games_genres_genre_name_game_id', game_genres_table.c.genre_name, game_genres_table.c.game_id)
 
 users_table = Table(
     'users', metadata,
     Column('user_id', Integer, primary_key=True, autoincrement=True),
-    Column('username', String(255), nullable=False),
+    Column('username', String(255), nullable=False, unique=True, index=True),
     Column('password', String(255), nullable=False),
 )
 
 favourite_games_table = Table(
     'user_favourite_games', metadata,
     Column('username', ForeignKey('users.username'), primary_key=True),
-    Column('game_id', ForeignKey('games.game_id'), primary_key=True)
+    Column('game_id', ForeignKey('games.game_id'), primary_key=True),
+    # Increases with every favourite added, so favourites are listed in the order they were added, as in memory
+    Column('position', Integer, default=text('(SELECT COALESCE(MAX(position), 0) + 1 FROM user_favourite_games)'))
 )
+# Pages of a user's favourites are read in order from the index
+Index('ix_user_favourite_games_username_position', favourite_games_table.c.username, favourite_games_table.c.position)
 
 review_table = Table(
     'review', metadata,
     Column('review_id', Integer, primary_key=True, autoincrement=True),
     Column('comment', Text, nullable=False),
     Column('user_id', ForeignKey('users.user_id'), nullable=False),
-    Column('game_id', ForeignKey('games.game_id'), nullable=False),
-    Column('time_posted', String, nullable=False),
+    Column('game_id', ForeignKey('games.game_id'), nullable=False, index=True),
+    Column('time_posted', ReviewTimestamp, nullable=False),
     Column('rating', Integer, nullable=False),
 
 )
+# A user can only review a game once. The index also serves lookups of a user's reviews by user_id
+Index('uq_review_user_id_game_id', review_table.c.user_id, review_table.c.game_id, unique=True)
+# A user's reviews are listed most recent first
+Index('ix_review_user_id_time_posted', review_table.c.user_id, review_table.c.time_posted)
+
+
+# Version of the stored data's format, kept in SQLite's user_version. Each data migration in upgrade_schema runs once,
+# on databases older than the version it brings them to:
+#   1. Release dates and review times stored as dates rather than text
+#   2. Favourites numbered in the order they were added
+#   3. Each game's rating count, sum and histogram filled from its reviews
+SCHEMA_VERSION = 3
+
+
+def _get_schema_version(connection) -> int:
+    # Only SQLite databases were ever created with the older formats, others are always up to date
+    if connection.dialect.name != 'sqlite':
+        return SCHEMA_VERSION
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def _set_schema_version(connection, version: int):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+# Databases created from the tables above already store their data in the current format
+event.listen(metadata, 'after_create',
+             lambda target, connection, **kwargs: _set_schema_version(connection, SCHEMA_VERSION))
+
+
+def upgrade_schema(engine):
+    # Bring an existing database up to date with the tables above without repopulating it: create missing tables,
+    # add missing columns (which need a server default if they are not nullable) and create missing indexes
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                table.create(connection)
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.execute(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}')
+
+            existing_indexes = _get_index_names(connection, inspector, table.name)
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+        # Data migrations read every row, so they only run on databases older than the current version
+        version = _get_schema_version(connection)
+        if version < 1:
+            _convert_text_dates(connection, games_table.c.release_date, RELEASE_DATE_FORMAT)
+            _convert_text_dates(connection, review_table.c.time_posted, REVIEW_TIME_FORMAT)
+        if version < 2:
+            # Rowids follow insertion order, as the table has no integer primary key
+            connection.exec_driver_sql('UPDATE user_favourite_games SET position = rowid WHERE position IS NULL')
+        if version < 3:
+            _rebuild_rating_aggregates(connection)
+        if version < SCHEMA_VERSION:
+            _set_schema_version(connection, SCHEMA_VERSION)
+
+        _create_full_text_index(connection)
+
+
+def _create_full_text_index(connection):
+    # Databases created before search was backed by FTS5 need the index and its triggers, filled from the games table
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                        (GAMES_FTS_TABLE,)).scalar()
+    if exists:
+        return
+
+    for statement in GAMES_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    rebuild_full_text_index(connection)
+
+
+def rebuild_full_text_index(connection):
+    # Reindexes every game, which is much faster than indexing games one at a time through the triggers
+    connection.exec_driver_sql(f"INSERT INTO {GAMES_FTS_TABLE}({GAMES_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_full_text_triggers(connection) -> bool:
+    # Stops the full-text index following changes to games, until it's rebuilt and create_full_text_triggers is
+    # called. Returns whether the database has a full-text index
+    if connection.dialect.name != 'sqlite':
+        return False
+
+    exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                        (GAMES_FTS_TABLE,)).scalar()
+    if exists:
+        for trigger_name in GAMES_FTS_TRIGGERS:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger_name}')
+    return bool(exists)
+
+
+def create_full_text_triggers(connection):
+    for statement in GAMES_FTS_TRIGGERS.values():
+        connection.exec_driver_sql(statement)
+
+
+def _convert_text_dates(connection, column, text_format: str):
+    # Release dates and review times used to be stored as text, e.g. "Oct 21, 2008". Read the column back untyped
+    # and rewrite any values in that format through the column's type
+    table = column.table
+    primary_key = list(table.primary_key.columns)[0]
+    rows = connection.execute(select(primary_key, type_coerce(column, String))).fetchall()
+    for key, value in rows:
+        try:
+            datetime.strptime(value, text_format)
+        except (TypeError, ValueError):
+            continue
+
+        connection.execute(table.update().where(primary_key == key).values({column.name: value}))
+
+
+def _rebuild_rating_aggregates(connection):
+    # The rating columns were added empty to databases that already had reviews, so recount them from the reviews
+    connection.execute(games_table.update().values(rating_count=0, rating_sum=0, rating_histogram=[0] * 6))
+
+    histograms = dict()
+    rows = connection.execute(select(review_table.c.game_id, review_table.c.rating, func.count())
+                              .group_by(review_table.c.game_id, review_table.c.rating))
+    for game_id, rating, count in rows:
+        histograms.setdefault(game_id, [0] * 6)[rating] = count
+
+    for game_id, histogram in histograms.items():
+        connection.execute(games_table.update().where(games_table.c.game_id == game_id).values(
+            rating_count=sum(histogram),
+            rating_sum=sum(rating * count for rating, count in enumerate(histogram)),
+            rating_histogram=histogram,
+        ))
+
+
+def _get_index_names(connection, inspector, table_name):
+    if connection.dialect.name == 'sqlite':
+        # The SQLite inspector skips expression-based indexes such as lower(game_title), so read the schema table
+        rows = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                                          (table_name,))
+        return {row[0] for row in rows}
+
+    return {index['name'] for index in inspector.get_indexes(table_name)}
 
 
 def map_model_to_tables():
@@ -79,7 +311,11 @@ def map_model_to_tables():
         '_Game__website_url': games_table.c.game_website_url,
         '_Game__publisher': relationship(Publisher),
         '_Game__genres': relationship(Genre, secondary=game_genres_table),
-        '_Game__reviews': relationship(Review),
+        # Removing a review from its game or user deletes it, rather than clearing its non-nullable foreign key
+        '_Game__reviews': relationship(Review, cascade='all, delete-orphan'),
+        '_Game__rating_count': games_table.c.rating_count,
+        '_Game__rating_sum': games_table.c.rating_sum,
+        '_Game__rating_histogram': games_table.c.rating_histogram,
     })
 
     mapper(Genre, genres_table, properties={
@@ -90,8 +326,12 @@ def map_model_to_tables():
         '_User__user_id': users_table.c.user_id,
         '_User__username': users_table.c.username,
         '_User__password': users_table.c.password,
-        '_User__reviews': relationship(Review),
-        '_User__favourite_games': relationship(Game, secondary=favourite_games_table)
+        '_User__reviews': relationship(Review, cascade='all, delete-orphan'),
+        # Favourites are keyed by game_id to match the dict used by the domain model
+        '_User__favourite_games': relationship(Game, secondary=favourite_games_table,
+                                               collection_class=attribute_mapped_collection('game_id'),
+                                               order_by=[favourite_games_table.c.position,
+                                                         favourite_games_table.c.game_id])
 
     })
 
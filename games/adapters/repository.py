@@ -1,16 +1,112 @@
 import abc
-from typing import List
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
 
 from games.domainmodel.model import Game, Genre, Publisher, User, Review
 
 repo_instance = None
 
+# Upper bounds of the price buckets counted for search facets. A game falls in the first bucket whose bound is at least
+# its price, matching the price_max filter, or in the bucket with no bound (None) if it costs more than all of them
+PRICE_BUCKET_BOUNDS = (0.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0)
+
+
+def price_bucket(price: float) -> float | None:
+    idx = bisect_left(PRICE_BUCKET_BOUNDS, price)
+    return PRICE_BUCKET_BOUNDS[idx] if idx < len(PRICE_BUCKET_BOUNDS) else None
+
 
 class RepositoryException(Exception):
     def __init__(self, message=None):
         print(f'RepositoryException: {message}')
 
 
+class SearchRequest:
+    """ A search term and the filters its results must pass, evaluated by the repository.
+
+    Games match the term by its words in their title, publisher or description (up to limit games, most relevant
+    first), and by a publisher, genre or title starting with it (up to title_limit games of each). Only games by the
+    publisher, priced at most price_max and in any of the genres (all of them if match_all_genres is True) are
+    returned. A filter that is None or empty is not applied.
+    """
+
+    def __init__(self, term: str, publisher: str = None, price_max: float = None, genres: Iterable[str] = (),
+                 limit: int = 10, title_limit: int = 10, match_all_genres: bool = False):
+        self.__term = term.strip() if term else ''
+        self.__publisher = publisher.strip() if publisher and publisher.strip() else None
+        self.__price_max = price_max
+        self.__genres = tuple(genre for genre in genres if genre)
+        self.__limit = limit
+        self.__title_limit = title_limit
+        self.__match_all_genres = match_all_genres
+
+    @property
+    def term(self) -> str:
+        return self.__term
+
+    @property
+    def publisher(self) -> str | None:
+        return self.__publisher
+
+    @property
+    def price_max(self) -> float | None:
+        return self.__price_max
+
+    @property
+    def genres(self) -> Tuple[str, ...]:
+        return self.__genres
+
+    @property
+    def limit(self) -> int:
+        return self.__limit
+
+    @property
+    def title_limit(self) -> int:
+        return self.__title_limit
+
+    @property
+    def match_all_genres(self) -> bool:
+        return self.__match_all_genres
+
+    def __repr__(self):
+        return f'<SearchRequest {self.__term!r} publisher={self.__publisher!r} price_max={self.__price_max!r} ' \
+               f'genres={self.__genres!r} match_all_genres={self.__match_all_genres!r}>'
+
+
+class SearchFacets:
+    """ Number of games in a set of search results for each genre, publisher and price bucket they have.
+
+    Genres and publishers are keyed by name, and price buckets by their upper bound (see price_bucket). Only the
+    genres, publishers and buckets of at least one game are included.
+    """
+
+    def __init__(self, genres: Dict[str, int] = None, publishers: Dict[str, int] = None,
+                 prices: Dict[float | None, int] = None):
+        self.__genres = genres if genres is not None else dict()
+        self.__publishers = publishers if publishers is not None else dict()
+        self.__prices = prices if prices is not None else dict()
+
+    @property
+    def genres(self) -> Dict[str, int]:
+        return self.__genres
+
+    @property
+    def publishers(self) -> Dict[str, int]:
+        return self.__publishers
+
+    @property
+    def prices(self) -> Dict[float | None, int]:
+        return self.__prices
+
+    def __repr__(self):
+        return f'<SearchFacets genres={self.__genres!r} publishers={self.__publishers!r} prices={self.__prices!r}>'
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__):
+            return False
+        return (other.genres, other.publishers, other.prices) == (self.__genres, self.__publishers, self.__prices)
+
+
 class AbstractRepository(abc.ABC):
     @abc.abstractmethod
     def add_user(self, user: User):
@@ -32,7 +128,25 @@ class AbstractRepository(abc.ABC):
 
     @abc.abstractmethod
     def get_games(self) -> List[Game]:
-        """ Returns the list of games """
+        """ Returns a new list of all games, which callers may reorder without affecting the repository """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_games_page(self, offset: int, limit: int, order_by: str = 'title') -> List[Game]:
+        """ Returns at most limit Games, skipping the first offset Games in the given ordering.
+
+        Games can be ordered by 'title' (ties broken by game id) or by 'game_id'. Any other ordering raises a
+        RepositoryException.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_games_after(self, title: str, game_id: int, limit: int) -> List[Game]:
+        """ Returns at most limit Games that come after the Game with the given title and id in title order.
+
+        This is keyset pagination: passing the title and id of the last Game on one page returns the next page, at the
+        same cost however deep the page is.
+        """
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -66,14 +180,26 @@ class AbstractRepository(abc.ABC):
         """ Returns the list of genres """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_genre_popularity(self, limit: int = None) -> List[Tuple[str, int]]:
+        """ Returns (genre_name, number of games) tuples, from the most to the least popular genre.
+
+        Genres with the same number of games are ordered by name. If limit is given, at most limit tuples are returned.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_publishers(self) -> List[Publisher]:
         """ Returns the list of publishers """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get_games_for_genre(self, genre_name: str):
-        """ Returns a list of Games with the specified genre name.
+    def get_games_for_genre(self, genre_name: str, prefix_match: bool = True, offset: int = 0, limit: int = None):
+        """ Returns a list of Games with the specified genre name, ordered by game id.
+
+        Genre names are matched case-insensitively. If prefix_match is True, the first Genre whose name starts with
+        genre_name is used, otherwise the whole name must match. If limit is given, at most limit Games are returned
+        after skipping the first offset Games.
 
         If there are no Games with the listed Genre, this method returns an empty list.
         """
@@ -81,8 +207,9 @@ class AbstractRepository(abc.ABC):
 
     @abc.abstractmethod
     def get_games_for_publisher(self, publisher_name: str):
-        """ Returns a list of Games with the specified publisher.
+        """ Returns a list of Games with the specified publisher, ordered by game id.
 
+        The first Publisher whose name starts with publisher_name, ignoring case, is used.
         If there are no Games with the listed Publisher, this method returns an empty list.
         """
         raise NotImplementedError
@@ -96,8 +223,56 @@ class AbstractRepository(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get_num_games_for_genre(self, genre_name: str):
-        """ Returns the number of games associated with the specified genre in the repository """
+    def get_games_from_title(self, title: str, limit: int = 10) -> List[Game]:
+        """ Returns up to limit Games whose titles start with title, ignoring case.
+
+        Games are ordered by lower-cased title, then by game id. If there are no matching Games, this method returns
+        an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_games(self, query: str, limit: int = 10, offset: int = 0) -> List[Game]:
+        """ Returns up to limit Games whose title, publisher or description match the words in query, most relevant
+        first, after skipping the first offset matches.
+
+        If no Games match, this method returns an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_games_with_snippets(self, query: str, limit: int = 10, offset: int = 0) -> List[Tuple[Game, str]]:
+        """ Returns the same Games as search_games, each paired with a snippet of its description.
+
+        Words in the snippet matching the query are enclosed in search_index.SNIPPET_MATCH_START and
+        SNIPPET_MATCH_END.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search(self, request: SearchRequest) -> List[Tuple[Game, str]]:
+        """ Returns the Games matching the request's term and passing all of its filters.
+
+        Games matched by full-text search come first, most relevant first and paired with a snippet of their
+        description, followed by the other Games by publisher, genre and title, paired with an empty snippet.
+        If the request has no term, this method returns an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_search_facets(self, game_ids: List[int]) -> SearchFacets:
+        """ Returns the number of the Games with the given ids for each genre, publisher and price bucket.
+
+        Ids of Games not in the repository are ignored.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_num_games_for_genre(self, genre_name: str, prefix_match: bool = True):
+        """ Returns the number of games associated with the specified genre in the repository.
+
+        Genre names are matched in the same way as get_games_for_genre.
+        """
 
         raise NotImplementedError
 
@@ -106,18 +281,31 @@ class AbstractRepository(abc.ABC):
         """ Returns 3 most recent Games from the repository """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_most_recent_games(self, n: int) -> List[Game]:
+        """ Returns the n most recently released Games, most recent first.
+
+        Games released on the same day are ordered by game id. Games without a release date are not included.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def add_review(self, review: Review):
         """ Adds a Review to the repository.
 
-        If the Review doesn't have bidirectional links with a Game and a User, this method raises a
-        RepositoryException and doesn't update the repository.
+        If the Review doesn't have bidirectional links with a Game and a User, or the User has already reviewed the
+        Game, this method raises a RepositoryException and doesn't update the repository.
         """
         if review.user is None or review not in review.user.reviews:
             raise RepositoryException('Review not correctly attached to a User')
         if review.game is None or review not in review.game.reviews:
             raise RepositoryException('Review not correctly attached to a Game')
 
+    @abc.abstractmethod
+    def has_user_reviewed_game(self, user: User, game: Game) -> bool:
+        """ Returns True if the User has reviewed the Game, without reading the Game's reviews. """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_user_review_for_game(self, user: User, game: Game):
         """ Returns a Review object with the specified user reviewer and game.
@@ -132,12 +320,32 @@ class AbstractRepository(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get_favourites(self, user: User):
-        """ Retrieves the users favourite games """
+    def get_favourites(self, user: User, offset: int = 0, limit: int = None):
+        """ Retrieves the users favourite games, in the order they were favourited.
+
+        If limit is given, at most limit games are returned after skipping the first offset games.
+        """
 
     @abc.abstractmethod
-    def get_reviews(self, user: User):
-        """ Retrieves the uses favourite games """
+    def get_number_of_favourites(self, user: User) -> int:
+        """ Returns the number of games in the user's favourites """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_reviews(self, user: User = None, offset: int = 0, limit: int = None):
+        """ Retrieves the user's reviews, most recent first.
+
+        If limit is given, at most limit Reviews are returned after skipping the first offset Reviews. If no user is
+        given, this method returns every Review in the repository.
+        """
+
+    @abc.abstractmethod
+    def get_most_recent_review(self, user: User):
+        """ Returns the user's most recently posted Review.
+
+        If the user hasn't posted any Reviews, this method returns None.
+        """
+        raise NotImplementedError
 
     @abc.abstractmethod
     def add_game_to_favourites(self, user: User, game: Game):
@@ -1,8 +1,25 @@
 import os
+import time
+from itertools import islice
 from pathlib import Path
 
 from games.adapters.repository import AbstractRepository
 from games.adapters.datareader.csvdatareader import GameFileCSVReader
+from games.adapters.orm import (
+    publishers_table, genres_table, games_table, game_genres_table, drop_full_text_triggers,
+    create_full_text_triggers, rebuild_full_text_index
+)
+
+# Number of rows sent to the database in each executemany call by populate_database
+BULK_INSERT_BATCH_SIZE = 5000
+
+# Pragmas used while bulk loading an SQLite database: the load is a single transaction that can simply be rerun if it
+# fails, so there's no need to sync to disk part way through it
+SQLITE_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': '-65536',
+}
 
 
 def populate(data_path: Path, repo: AbstractRepository):
@@ -25,3 +42,70 @@ def populate(data_path: Path, repo: AbstractRepository):
 
     # Add games to the repo
     repo.add_multiple_games(games)
+
+
+def populate_database(data_path: Path, engine, batch_size: int = BULK_INSERT_BATCH_SIZE):
+    # Load the games straight into the tables with batched INSERTs in one transaction, rather than merging each
+    # object through the ORM session, which costs a SELECT per row. Returns the number of rows inserted and the time
+    # in seconds the inserts took.
+    games_file_name = str(Path(data_path) / "games.csv")
+
+    reader = GameFileCSVReader(games_file_name)
+
+    reader.read_csv_file()
+
+    publisher_rows = [{'name': publisher.publisher_name} for publisher in reader.dataset_of_publishers
+                      if publisher.publisher_name is not None]
+    genre_rows = [{'genre_name': genre.genre_name} for genre in reader.dataset_of_genres]
+    game_rows = list()
+    game_genre_rows = list()
+    for game in reader.dataset_of_games:
+        game_rows.append({
+            'game_id': game.game_id,
+            'game_title': game.title,
+            'game_price': game.price,
+            'release_date': game.release_date,
+            'game_description': game.description,
+            'game_image_url': game.image_url,
+            'game_website_url': game.website_url,
+            'publisher_name': game.publisher.publisher_name if game.publisher is not None else None,
+        })
+        game_genre_rows += [{'game_id': game.game_id, 'genre_name': genre.genre_name} for genre in game.genres]
+
+    start_time = time.perf_counter()
+    num_rows = 0
+    with engine.connect() as connection:
+        previous_pragmas = _set_load_pragmas(connection)
+        try:
+            with connection.begin():
+                # Index the games for search once they're all loaded, rather than row by row through the triggers
+                full_text_indexed = drop_full_text_triggers(connection)
+                for table, rows in ((publishers_table, publisher_rows), (genres_table, genre_rows),
+                                    (games_table, game_rows), (game_genres_table, game_genre_rows)):
+                    rows = iter(rows)
+                    batch = list(islice(rows, batch_size))
+                    while batch:
+                        connection.execute(table.insert(), batch)
+                        num_rows += len(batch)
+                        batch = list(islice(rows, batch_size))
+                if full_text_indexed:
+                    create_full_text_triggers(connection)
+                    rebuild_full_text_index(connection)
+        finally:
+            for name, value in previous_pragmas.items():
+                connection.exec_driver_sql(f'PRAGMA {name} = {value}')
+
+    elapsed = time.perf_counter() - start_time
+    return num_rows, elapsed
+
+
+def _set_load_pragmas(connection):
+    # Returns the previous values of the pragmas that were changed, so they can be restored after the load
+    if connection.dialect.name != 'sqlite':
+        return dict()
+
+    previous_pragmas = dict()
+    for name, value in SQLITE_LOAD_PRAGMAS.items():
+        previous_pragmas[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        connection.exec_driver_sql(f'PRAGMA {name} = {value}')
+    return previous_pragmas
@@ -0,0 +1,255 @@
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from heapq import heappush, heappushpop
+from typing import Callable, Dict, List, Tuple
+
+from games.domainmodel.model import Game
+
+# Words too common to say anything about a game. They're left out of the index, which also keeps the longest
+# posting lists, and so the slowest queries, out of it
+STOP_WORDS = frozenset("""
+a about all also an and any are as at be been but by can do for from has have he her his how i if in into is it its
+just more most my no not of on one or our out she so some such than that the their them then there these they this
+to up us was we were what when which who will with you your
+""".split())
+
+# Each field's term frequencies are multiplied by its weight, so a match in the title counts for more than a match in
+# the description
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'publisher': 2.0,
+    'description': 1.0,
+}
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Term weights in the impact lists are computed with the average document length when the lists were built, and the
+# lists are rebuilt once the average has drifted from that by more than this factor either way
+IMPACTS_MAX_DRIFT = 1.1
+
+# Snippets of game descriptions mark the words matching the search between these control characters, which can't
+# appear in the text, so the view layer can escape the snippet and then highlight the matches
+SNIPPET_MATCH_START = '\x02'
+SNIPPET_MATCH_END = '\x03'
+SNIPPET_ELLIPSIS = '…'
+# Number of words in a snippet
+SNIPPET_LENGTH = 16
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return list()
+    return [token for token in TOKEN_PATTERN.findall(text.casefold()) if token not in STOP_WORDS]
+
+
+def game_fields(game: Game) -> Dict[str, str]:
+    publisher = game.publisher.publisher_name if game.publisher is not None else None
+    return {
+        'title': game.title,
+        'publisher': publisher,
+        'description': game.description,
+    }
+
+
+class SearchIndex:
+    """ Inverted index over the title, publisher and description of each game, ranked with BM25.
+
+    Each term's postings are also kept ordered by their BM25 term weight, so a search can stop reading postings once
+    no unread game could make it into the top results (Fagin's threshold algorithm).
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.__k1 = k1
+        self.__b = b
+        # term -> {game_id: weighted term frequency}
+        self.__postings: Dict[str, Dict[int, float]] = dict()
+        # game_id -> (weighted document length, terms in the document), so a game can be removed from its postings
+        self.__documents: Dict[int, Tuple[float, Tuple[str, ...]]] = dict()
+        self.__total_length = 0.0
+        # term -> [(-term weight, game_id)], highest weight first. Built lazily by searches and kept up to date as games
+        # are added and removed, with weights computed from the average document length when they were first built
+        self.__impacts: Dict[str, List[Tuple[float, int]]] = dict()
+        self.__impacts_average_length = None
+
+    def __len__(self):
+        return len(self.__documents)
+
+    def __contains__(self, game_id: int):
+        return game_id in self.__documents
+
+    def add_game(self, game: Game):
+        if game.game_id in self.__documents:
+            self.remove_game(game.game_id)
+
+        game_id = game.game_id
+        term_frequencies = dict()
+        for field, text in game_fields(game).items():
+            weight = FIELD_WEIGHTS[field]
+            for term, count in Counter(tokenize(text)).items():
+                term_frequencies[term] = term_frequencies.get(term, 0.0) + weight * count
+
+        length = sum(term_frequencies.values())
+        postings = self.__postings
+        impacts = self.__impacts
+        for term, frequency in term_frequencies.items():
+            posting_list = postings.get(term)
+            if posting_list is None:
+                postings[term] = {game_id: frequency}
+            else:
+                posting_list[game_id] = frequency
+
+            term_impacts = impacts.get(term)
+            if term_impacts is not None:
+                insort(term_impacts, (-self.__term_weight(frequency, length, self.__impacts_average_length), game_id))
+
+        self.__documents[game_id] = (length, tuple(term_frequencies))
+        self.__total_length += length
+
+    def remove_game(self, game_id: int):
+        document = self.__documents.pop(game_id, None)
+        if document is None:
+            return
+
+        length, terms = document
+        impacts = self.__impacts
+        for term in terms:
+            posting_list = self.__postings[term]
+            frequency = posting_list.pop(game_id)
+            if not posting_list:
+                del self.__postings[term]
+
+            term_impacts = impacts.get(term)
+            if term_impacts is not None:
+                # The weight is recomputed exactly as it was when the game was added, so the entry is found by bisection
+                impact = (-self.__term_weight(frequency, length, self.__impacts_average_length), game_id)
+                del term_impacts[bisect_left(term_impacts, impact)]
+                if not term_impacts:
+                    del impacts[term]
+
+        self.__total_length -= length
+
+    def search(self, query: str, limit: int = 10, accept: Callable[[int], bool] = None) -> List[Tuple[int, float]]:
+        """ Returns up to limit (game_id, score) pairs for the games best matching the query, highest score first.
+
+        Games with equal scores are ordered by game id. If accept is given, only the games for whose id it returns True
+        are considered.
+        """
+        num_documents = len(self.__documents)
+        if num_documents == 0 or limit <= 0:
+            return list()
+
+        query_terms = list()
+        for term in set(tokenize(query)):
+            posting_list = self.__postings.get(term)
+            if posting_list is not None:
+                document_frequency = len(posting_list)
+                idf = math.log(1 + (num_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+                query_terms.append((term, idf, posting_list))
+        if not query_terms:
+            return list()
+
+        average_length = self.__total_length / num_documents
+        impacts_scale = self.__refresh_impacts(average_length)
+        query_terms = [(idf, posting_list, self.__get_impacts(term)) for term, idf, posting_list in query_terms]
+
+        documents = self.__documents
+        # Min-heap of (score, -game_id), so the root is the worst of the best results found so far
+        top_results = list()
+        scored = set()
+        depth = 0
+        while True:
+            # The highest score any game not yet read could have
+            threshold = 0.0
+            exhausted = True
+            for idf, _, impacts in query_terms:
+                if depth >= len(impacts):
+                    continue
+                exhausted = False
+                negated_weight, game_id = impacts[depth]
+                threshold -= idf * negated_weight * impacts_scale
+                if game_id in scored:
+                    continue
+
+                scored.add(game_id)
+                if accept is not None and not accept(game_id):
+                    continue
+
+                length = documents[game_id][0]
+                score = 0.0
+                for other_idf, other_posting_list, _ in query_terms:
+                    frequency = other_posting_list.get(game_id)
+                    if frequency is not None:
+                        score += other_idf * self.__term_weight(frequency, length, average_length)
+
+                if len(top_results) < limit:
+                    heappush(top_results, (score, -game_id))
+                elif (score, -game_id) > top_results[0]:
+                    heappushpop(top_results, (score, -game_id))
+
+            # An unread game scoring exactly the threshold could still win a tie on its id, so only a strictly higher
+            # score ends the search early
+            if exhausted or (len(top_results) == limit and top_results[0][0] > threshold):
+                break
+            depth += 1
+
+        return [(-negated_game_id, score) for score, negated_game_id in sorted(top_results, reverse=True)]
+
+    def __term_weight(self, frequency: float, length: float, average_length: float) -> float:
+        # BM25 term weight, with the document's length normalised against the average length
+        k1 = self.__k1
+        return frequency * (k1 + 1) / (frequency + k1 * (1 - self.__b + self.__b * length / average_length))
+
+    def __refresh_impacts(self, average_length: float) -> float:
+        """ Discards the impact lists if the average document length has drifted too far since they were built, and
+        returns the factor by which their weights must be scaled to remain upper bounds of the current weights.
+        """
+        if self.__impacts_average_length is not None:
+            drift = average_length / self.__impacts_average_length
+            if 1 / IMPACTS_MAX_DRIFT <= drift <= IMPACTS_MAX_DRIFT:
+                # A term weight only grows with the average length, and by at most the same factor
+                return max(1.0, drift)
+
+        self.__impacts.clear()
+        self.__impacts_average_length = average_length
+        return 1.0
+
+    def __get_impacts(self, term: str) -> List[Tuple[float, int]]:
+        impacts = self.__impacts.get(term)
+        if impacts is None:
+            documents = self.__documents
+            average_length = self.__impacts_average_length
+            impacts = sorted((-self.__term_weight(frequency, documents[game_id][0], average_length), game_id)
+                             for game_id, frequency in self.__postings[term].items())
+            self.__impacts[term] = impacts
+        return impacts
+
+
+def make_snippet(text: str, query: str, length: int = SNIPPET_LENGTH) -> str:
+    """ Returns up to length words of text around its first word matching the query, with matching words marked. """
+    if not text:
+        return ''
+
+    terms = set(tokenize(query))
+    words = list(TOKEN_PATTERN.finditer(text))
+    first_match = next((i for i, word in enumerate(words) if word.group().casefold() in terms), 0)
+    # Show a little of the text before the first match
+    start = max(0, min(first_match - length // 4, len(words) - length))
+    end = min(len(words), start + length)
+    if start >= end:
+        return ''
+
+    parts = [SNIPPET_ELLIPSIS] if start > 0 else []
+    position = words[start].start()
+    for word in words[start:end]:
+        parts.append(text[position:word.start()])
+        if word.group().casefold() in terms:
+            parts.append(SNIPPET_MATCH_START + word.group() + SNIPPET_MATCH_END)
+        else:
+            parts.append(word.group())
+        position = word.end()
+    if end < len(words):
+        parts.append(SNIPPET_ELLIPSIS)
+
+    return ''.join(parts)
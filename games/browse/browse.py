@@ -24,9 +24,16 @@ def browse_games():
     if pagination_object['page_number'] > pagination_object['num_pages']:
         return redirect(f"/games?page={pagination_object['num_pages']}")
 
-    games_to_display = services.get_games_for_page(pagination_object['page_number'], pagination_object['num_games_per_page'], repo.repo_instance)
+    # The 'after' query parameter holds the id of the last game on the previous page, if the user clicked 'Next'
+    after_game_id = request.args.get('after')
+    after_game_id = int(after_game_id) if after_game_id is not None and after_game_id.isnumeric() else None
+
+    games_to_display = services.get_games_for_page(pagination_object['page_number'], pagination_object['num_games_per_page'], repo.repo_instance, after_game_id)
     featured_genres = utilities.get_featured_genres()
 
+    # Pass the last game on this page on to the 'Next' link, so the next page can be fetched with a keyset query
+    next_cursor = games_to_display[-1]['game_id'] if games_to_display else None
+
     return render_template(
         'browse/games.html',
         # Custom page title
@@ -39,6 +46,7 @@ def browse_games():
         num_games=num_games,
         featured_genres=featured_genres,
         num_pages=pagination_object['num_pages'],
+        next_cursor=next_cursor,
     )
 
 @browse_blueprint.route('/games/<int:game_id>', methods=['GET'])
@@ -55,6 +63,7 @@ def game(game_id):
         current_game = services.get_game(game_id, repo.repo_instance)
         reviews = services.get_reviews_for_game(game_id, repo.repo_instance)
         average_rating = services.calculate_average_rating_for_game(game_id, repo.repo_instance)
+        rating_distribution = services.get_rating_distribution_for_game(game_id, repo.repo_instance)
 
         # If the user has signed in, check if they've already reviewed and/or favourited the game
         if "username" in session:
@@ -78,6 +87,7 @@ def game(game_id):
                            is_game_in_favourites=is_game_in_favourites,
                            featured_genres=featured_genres,
                            average_rating=average_rating,
+                           rating_distribution=rating_distribution,
                            form=form,
                            delete_review_url=delete_review_url,
                            reviews=reviews,
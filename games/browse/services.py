@@ -31,15 +31,23 @@ def get_games(repo: AbstractRepository):
 def sort_games_alphabetically(games: List[Game]) -> List[Game]:
     games.sort(key=lambda g: g.title)
 
-def get_games_for_page(page_number: int, num_games_per_page: int, repo: AbstractRepository):
-    # Get all games first
-    games = get_games(repo)
+def get_games_for_page(page_number: int, num_games_per_page: int, repo: AbstractRepository, after_game_id: int = None):
+    # If the id of the last game on the previous page is known, seek straight past it (keyset pagination)
+    if after_game_id is not None:
+        last_game = repo.get_game(after_game_id)
+
+        if last_game is not None and last_game.title is not None:
+            games = repo.get_games_after(last_game.title, last_game.game_id, num_games_per_page)
+
+            return games_to_dict(games)
+
     # The offset will be the num_games_per_page * page number -1 to 0-index
-    starting_idx = num_games_per_page * (page_number - 1)
-    # The limit (aka list length returned) here is num_games_per_page
-    ending_idx = starting_idx + num_games_per_page
+    offset = num_games_per_page * (page_number - 1)
+
+    # Only the games on this page are retrieved (sorted alphabetically) and converted to dicts
+    games = repo.get_games_page(offset, num_games_per_page, order_by='title')
 
-    return games[starting_idx:ending_idx]
+    return games_to_dict(games)
 
 
 def get_game(game_id: int, repo: AbstractRepository):
@@ -105,29 +113,36 @@ def get_reviews_for_game(game_id: int, repo: AbstractRepository):
 
 def check_has_user_reviewed_game(game_id: int, username: str, repo: AbstractRepository):
     game = repo.get_game(game_id)
+    user = repo.get_user(username)
 
-    if any(review.user.username == username for review in game.reviews):
-        return True
+    if game is None or user is None:
+        return False
 
-    return False
+    return repo.has_user_reviewed_game(user, game)
 
 # Calculates the average rating for a game. Returns None if no reviews have been submitted
 def calculate_average_rating_for_game(game_id: int, repo: AbstractRepository):
     game = repo.get_game(game_id)
 
-    average = None
-    counter = 0
-    total_rating = 0
-
-    for review in game.reviews:
-        counter = counter + 1
-        total_rating = total_rating + review.rating
+    # The game keeps a running count and sum of its ratings, so its reviews don't need to be read
+    average = game.average_rating
 
-    if counter > 0:
-        average = round(total_rating/counter)
+    if average is not None:
+        average = round(average)
 
     return average
 
+# Retrieves the number of reviews with each rating, from 5 stars down to 0 stars
+def get_rating_distribution_for_game(game_id: int, repo: AbstractRepository):
+    game = repo.get_game(game_id)
+
+    if game is None:
+        raise NonExistentGameException
+
+    histogram = game.rating_histogram
+
+    return [{'rating': rating, 'count': histogram[rating]} for rating in range(len(histogram) - 1, -1, -1)]
+
 # Helper method to check that a game is in the user's favourites already
 def check_game_in_favourites(game_id: int, username: str, repo: AbstractRepository):
     user = repo.get_user(username)
@@ -1,4 +1,5 @@
 from datetime import datetime
+from itertools import islice
 
 
 class Publisher:
@@ -85,6 +86,12 @@ class Game:
         self.__reviews: list = []
         self.__publisher = None
 
+        # Running aggregates over the game's reviews, so ratings can be shown without reading every review
+        self.__rating_count = 0
+        self.__rating_sum = 0
+        # Number of reviews with each rating from 0 to 5
+        self.__rating_histogram = (0,) * 6
+
     @property
     def publisher(self) -> Publisher:
         return self.__publisher
@@ -179,6 +186,33 @@ class Game:
     def genres(self) -> list:
         return self.__genres
 
+    @property
+    def rating_count(self) -> int:
+        return self.__rating_count
+
+    @property
+    def rating_sum(self) -> int:
+        return self.__rating_sum
+
+    @property
+    def rating_histogram(self) -> tuple:
+        return tuple(self.__rating_histogram)
+
+    @property
+    def average_rating(self):
+        if self.__rating_count == 0:
+            return None
+        return self.__rating_sum / self.__rating_count
+
+    def __update_rating_aggregates(self, rating: int, change: int):
+        self.__rating_count += change
+        self.__rating_sum += rating * change
+
+        # Assign a new histogram rather than mutating it, so the change is picked up when the game is persisted
+        histogram = list(self.__rating_histogram)
+        histogram[rating] += change
+        self.__rating_histogram = tuple(histogram)
+
     def add_genre(self, genre: Genre):
         if not isinstance(genre, Genre) or genre in self.__genres:
             return
@@ -197,11 +231,20 @@ class Game:
         if not isinstance(new_review, Review) or new_review in self.__reviews:
             return
         self.__reviews.append(new_review)
+        self.__update_rating_aggregates(new_review.rating, 1)
 
     def remove_review(self, review):
         if not isinstance(review, Review) or review not in self.__reviews:
             return
         self.__reviews.remove(review)
+        self.__update_rating_aggregates(review.rating, -1)
+
+    def change_review_rating(self, review, old_rating: int):
+        # Called by Review when its rating changes, so an attached review moves from its old rating to its new one
+        if not isinstance(review, Review) or review not in self.__reviews:
+            return
+        self.__update_rating_aggregates(old_rating, -1)
+        self.__update_rating_aggregates(review.rating, 1)
 
     def __repr__(self):
         return f"<Game {self.__game_id}, {self.__game_title}>"
@@ -233,7 +276,8 @@ class User:
             raise ValueError('Password not valid!')
 
         self.__reviews: list[Review] = []
-        self.__favourite_games: list[Game] = []
+        # Favourite games keyed by game_id. Dicts keep insertion order, so the most recent favourite is the last one
+        self.__favourite_games: dict[int, Game] = {}
 
     @property
     def username(self):
@@ -259,17 +303,31 @@ class User:
 
     @property
     def favourite_games(self) -> list:
-        return self.__favourite_games
+        return list(self.__favourite_games.values())
+
+    @property
+    def number_of_favourite_games(self) -> int:
+        return len(self.__favourite_games)
+
+    @property
+    def most_recent_favourite_game(self):
+        return next(reversed(self.__favourite_games.values()), None)
+
+    def get_favourite_games_page(self, offset: int, limit: int) -> list:
+        return list(islice(self.__favourite_games.values(), offset, offset + limit))
+
+    def has_favourite_game(self, game) -> bool:
+        return isinstance(game, Game) and game.game_id in self.__favourite_games
 
     def add_favourite_game(self, game):
-        if not isinstance(game, Game) or game in self.__favourite_games:
+        if not isinstance(game, Game) or game.game_id in self.__favourite_games:
             return
-        self.__favourite_games.append(game)
+        self.__favourite_games[game.game_id] = game
 
     def remove_favourite_game(self, game):
-        if not isinstance(game, Game) or game not in self.__favourite_games:
+        if not isinstance(game, Game) or game.game_id not in self.__favourite_games:
             return
-        self.__favourite_games.remove(game)
+        del self.__favourite_games[game.game_id]
 
     def __repr__(self):
         return f"<User {self.__username}>"
@@ -340,7 +398,9 @@ class Review:
     @rating.setter
     def rating(self, new_rating: int):
         if isinstance(new_rating, int) and 0 <= new_rating <= 5:
+            old_rating = self.__rating
             self.__rating = new_rating
+            self.__game.change_review_rating(self, old_rating)
         else:
             raise ValueError("Rating must be an integer between 0 and 5")
 
@@ -404,12 +464,15 @@ class Wishlist:
 
 def make_review(review_text: str, rating: int, user: User, game: Game):
     review = Review(user, game, rating, review_text)
-    user.add_review(review)
+    # Attach the review to the game first: when persisted, attaching it to the user can flush the review, and the
+    # game would then see it as already added and skip updating its rating aggregates
     game.add_review(review)
+    user.add_review(review)
 
     return review
 
 
 def delete_review(review: Review):
-    review.user.remove_review(review)
+    # Detach the review from the game first, for the same reason as in make_review
     review.game.remove_review(review)
+    review.user.remove_review(review)
@@ -35,7 +35,7 @@ def genre(genre_name: str):
         return redirect(url_for('genres_bp.browse_genres'))
 
     featured_genres = utilities.get_featured_genres()
-    num_games = services.get_number_of_games_for_genre(genre_name, repo.repo_instance)
+    num_games = services.get_number_of_games_for_genre(genre_name, repo.repo_instance, prefix_match=False)
 
     pagination_object = services.get_paginated_genre_games(genre_name, repo.repo_instance)
 
@@ -29,8 +29,9 @@ def get_genres(repo: AbstractRepository):
     return genres_as_dict
 
 
-def get_games_for_genre(genre_name: str, repo: AbstractRepository):
-    games = repo.get_games_for_genre(genre_name)
+def get_games_for_genre(genre_name: str, repo: AbstractRepository, prefix_match: bool = True, offset: int = 0,
+                        limit: int = None):
+    games = repo.get_games_for_genre(genre_name, prefix_match, offset, limit)
 
     # Convert games to dict form
     games_as_dict = games_to_dict(games)
@@ -39,22 +40,23 @@ def get_games_for_genre(genre_name: str, repo: AbstractRepository):
 
 
 def get_paginated_genre_games(genre_name: str, repo: AbstractRepository):
-    # Get all games associated with that genre
-    games = get_games_for_genre(genre_name, repo)
+    # Count the games associated with that genre, the genre page always refers to a genre by its full name
+    num_games = get_number_of_games_for_genre(genre_name, repo, prefix_match=False)
 
-    pagination_object = utilities.pagination(len(games))
-    # Slice the games so that you return only the required games for this page
+    pagination_object = utilities.pagination(num_games)
+    # Only retrieve the games required for this page
     # The offset will be the num_games_per_page * page number -1 to 0-index
-    starting_idx = pagination_object['num_games_per_page'] * (pagination_object['page_number'] - 1)
+    offset = pagination_object['num_games_per_page'] * (pagination_object['page_number'] - 1)
 
     # The limit (aka list length returned) here is num_games_per_page
-    ending_idx = starting_idx + pagination_object['num_games_per_page']
+    games = get_games_for_genre(genre_name, repo, prefix_match=False, offset=offset,
+                                limit=pagination_object['num_games_per_page'])
 
-    return {'games': games[starting_idx:ending_idx], **pagination_object}
+    return {'games': games, **pagination_object}
 
 
-def get_number_of_games_for_genre(genre_name: str, repo: AbstractRepository):
-    return repo.get_num_games_for_genre(genre_name)
+def get_number_of_games_for_genre(genre_name: str, repo: AbstractRepository, prefix_match: bool = True):
+    return repo.get_num_games_for_genre(genre_name, prefix_match)
 
 
 # ============================================
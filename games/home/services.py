@@ -2,9 +2,13 @@ from games.adapters.repository import AbstractRepository
 from games.browse.services import games_to_dict
 
 
+# Number of recent games featured on the homepage
+NUM_FEATURED_GAMES = 3
+
+
 # Retrieve 3 most recent games to display on homepage
 def get_most_recent_games(repo: AbstractRepository):
-    games = repo.get_three_most_recent_games()
+    games = repo.get_most_recent_games(NUM_FEATURED_GAMES)
 
     # Turn games into dict
     return games_to_dict(games)
\ No newline at end of file
@@ -37,7 +37,19 @@ def user_profile():
 def see_favourites():
     try:
         featured_genres = utilities.get_featured_genres()
-        favourite_games = services.get_user_favourites(session["username"], repo.repo_instance)
+        num_favourites = services.get_number_of_user_favourites(session["username"], repo.repo_instance)
+
+        # Get pagination information
+        pagination_object = utilities.pagination(num_favourites)
+
+        # If the user tries to visit a page that's too high, redirect them to the last page
+        if pagination_object['num_pages'] > 0 and pagination_object['page_number'] > pagination_object['num_pages']:
+            return redirect(url_for('profile_bp.see_favourites', page=pagination_object['num_pages']))
+
+        favourite_games = services.get_user_favourites_for_page(session["username"],
+                                                                pagination_object['page_number'],
+                                                                pagination_object['num_games_per_page'],
+                                                                repo.repo_instance)
 
     # If for some reason the username is invalid in the session, then redirect to login
     except UnknownUserException:
@@ -48,6 +60,9 @@ def see_favourites():
         title="Favourite Games | CS235 Game Library",
         favourite_games=favourite_games,
         featured_genres=featured_genres,
+        page_url=url_for('profile_bp.see_favourites'),
+        current_page=pagination_object['page_number'],
+        num_pages=pagination_object['num_pages'],
     )
 
 
@@ -1,5 +1,4 @@
-from datetime import datetime
-from typing import List, Dict
+from typing import List
 from games.adapters.repository import AbstractRepository
 from games.authentication.services import UnknownUserException
 from games.browse.services import NonExistentGameException, games_to_dict, reviews_to_dict
@@ -43,41 +42,55 @@ def get_user_favourites(username: str, repo: AbstractRepository):
 
     return repo.get_favourites(user)
 
-def get_user_reviews(username: str, repo: AbstractRepository) -> List[Dict]:
-    """ Retrieve the users reviews """
+def get_user_favourites_for_page(username: str, page_number: int, num_games_per_page: int, repo: AbstractRepository):
+    """ Retrieve a single page of the users favourite games """
 
     user = repo.get_user(username)
 
     if user is None:
         raise UnknownUserException
 
-    # Automatically sort by date posted, descending (from most to least recent)
-    user.reviews.sort(key=lambda r: datetime.strptime(r.time_posted, "%b %d, %Y at %H:%M:%S"), reverse=True)
+    offset = num_games_per_page * (page_number - 1)
 
-    return repo.get_reviews(user)
+    return repo.get_favourites(user, offset, num_games_per_page)
+
+def get_number_of_user_favourites(username: str, repo: AbstractRepository):
+    user = repo.get_user(username)
+
+    if user is None:
+        raise UnknownUserException
+
+    return repo.get_number_of_favourites(user)
+
+def get_user_reviews(username: str, repo: AbstractRepository, offset: int = 0, limit: int = None) -> List[Review]:
+    """ Retrieve the users reviews, from most to least recent """
+
+    user = repo.get_user(username)
+
+    if user is None:
+        raise UnknownUserException
+
+    # The repository returns only this user's reviews, already sorted by date posted
+    return repo.get_reviews(user, offset, limit)
 
 def get_most_recent_review(username: str, repo: AbstractRepository):
-    # Get dictionaries
-    review_dicts = get_user_reviews(username, repo)
+    user = repo.get_user(username)
 
-    # If the user has no reviews, return None
-    if len(review_dicts):
-        # These should be sorted by date, so returning the first object in the list should return the most recent review
-        return review_dicts[0]
+    if user is None:
+        raise UnknownUserException
 
-    return None
+    # If the user has no reviews, this is None
+    return repo.get_most_recent_review(user)
 
 def get_most_recent_favourite(username: str, repo: AbstractRepository):
-    # Get favourites
-    favourite_dicts = get_user_favourites(username, repo)
+    user = repo.get_user(username)
 
-    # If the user has no favourites, return None
-    if len(favourite_dicts):
-        # These are appended to the end of the favourite_games list, so returning the last one should return the most
-        # recent favourite
-        return favourite_dicts[-1]
+    if user is None:
+        raise UnknownUserException
 
-    return None
+    # Favourites are kept in the order they were added, so the user can return the last one directly. If the user has
+    # no favourites, this is None
+    return user.most_recent_favourite_game
 
 
 
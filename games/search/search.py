@@ -10,6 +10,7 @@ search_blueprint = Blueprint('search_bp', __name__)
 @search_blueprint.route('/search', methods=['GET'])
 def search():
     result = list()
+    facets = None
     error_message = None
     term = request.args.get('term')
 
@@ -17,6 +18,10 @@ def search():
         # Pass the request object to controller to retrieve search results
         result = services.get_games_from_search_query(request, repo.repo_instance)
 
+        # Count the results for each filter option, so the filter form shows what each choice would leave
+        if len(result):
+            facets = services.get_search_facets(result, repo.repo_instance)
+
         if term:
             if not len(term.strip()):
                 error_message="Search term should not be blank."
@@ -26,11 +31,10 @@ def search():
         error_message=err
 
     featured_genres = utilities.get_featured_genres()
-    publishers = services.get_publishers(repo.repo_instance)
 
     return render_template('search/search.html',
                            featured_genres=featured_genres,
-                           publishers=publishers,
+                           facets=facets,
                            results=result,
                            term=term,
                            error_message=error_message,
@@ -1,12 +1,25 @@
-from typing import Iterable, List
+from typing import Iterable, Tuple
 
-from games.adapters.repository import AbstractRepository
+from markupsafe import Markup, escape
+
+from games.adapters.repository import AbstractRepository, SearchRequest, SearchFacets, PRICE_BUCKET_BOUNDS
+from games.adapters.search_index import SNIPPET_MATCH_START, SNIPPET_MATCH_END
 from games.browse.services import games_to_dict, game_to_dict
 
-import games.genres.services as genreServices
 from games.domainmodel.model import Publisher, Game
 
 
+# Maximum number of title matches added to the results of a search
+MAX_TITLE_MATCHES = 10
+
+# Maximum number of full-text matches, ranked by relevance, at the start of the results of a search
+MAX_FULL_TEXT_MATCHES = 50
+
+# Values of the genre_match search key: games in any of the selected genres, or in all of them
+GENRE_MATCH_ANY = 'any'
+GENRE_MATCH_ALL = 'all'
+
+
 class NonExistentSearchKeyException(Exception):
     pass
 
@@ -27,6 +40,26 @@ def get_games_for_publisher(publisher_name: str, repo: AbstractRepository):
 
     return games_as_dict
 
+# Retrieve the games whose titles start with the given string, in title order. If no games exist, return an empty list
+def get_games_from_title(title: str, repo: AbstractRepository, limit: int = MAX_TITLE_MATCHES):
+    games = repo.get_games_from_title(title, limit)
+
+    return games_to_dict(games)
+
+# Retrieve the games best matching the words in the query, most relevant first, each with a snippet of its description
+# highlighting the matching words. If no games match, return an empty list
+def search_games(query: str, repo: AbstractRepository, limit: int = MAX_FULL_TEXT_MATCHES, offset: int = 0):
+    return games_with_snippets_to_dict(repo.search_games_with_snippets(query, limit, offset))
+
+# Retrieve the games matching the search request's term and passing its filters, with the games found by full-text
+# search first. If no games match, return an empty list
+def search(search_request: SearchRequest, repo: AbstractRepository):
+    return games_with_snippets_to_dict(repo.search(search_request))
+
+# Escape a snippet for HTML, then wrap its matching words in <mark> tags
+def highlight_snippet(snippet: str):
+    return escape(snippet).replace(SNIPPET_MATCH_START, Markup('<mark>')).replace(SNIPPET_MATCH_END, Markup('</mark>'))
+
 # Retrieve a game based off a title. If no game exists, return None
 def get_game_from_title(title: str, repo: AbstractRepository):
     game = repo.get_game_from_title(title)
@@ -45,88 +78,54 @@ def get_games_from_search_query(request, repo: AbstractRepository):
     # Default variables to pass on to the view layer
     for arg in request.args:
         # If the user has typed in an invalid search key (i.e. from the URL), then throw an error & redirect to main search page at search layer
-        if arg not in ['term', 'price_max', 'publisher', 'genres']:
+        if arg not in ['term', 'price_max', 'publisher', 'genres', 'genre_match']:
             raise NonExistentSearchKeyException("Invalid search key. Please try again.")
 
     # Retrieve the search key
     if (request.args.get("term")):
         term = request.args.get("term").strip()
 
-    if term:
-        # Find all games associated with this term
-        # First search by publisher and genre
-        search_result = get_games_for_publisher(term, repo) + genreServices.get_games_for_genre(term, repo)
-
-        # See if a game with the title exists
-        game = get_game_from_title(term, repo)
-
-        # If game isn't None, then append result to search_results
-        if game:
-            search_result.append(game)
-
-    # Filtering
-    if (request.args.get("publisher")):
-        # Filter games by publisher
-        search_result = filter_games_by_publisher(request.args.get('publisher'), search_result)
-
+    # The price filter is checked even without a term, so an invalid price is always reported
+    price_max = None
     if (request.args.get("price_max")):
-        # Filter games by price
-        search_result = filter_games_by_price(request.args.get('price_max'), search_result)
-
-    # Use getlist as there can be multiple genres selected
-    if (request.args.getlist("genres")):
-        # Filter games by selected genres
-        search_result = filter_games_by_genre(request.args.getlist('genres'), search_result)
-
-    return search_result
+        price_max = parse_price(request.args.get('price_max'))
 
-# Filter games by publisher if the user has chosen to filter by publisher
-def filter_games_by_publisher(publisher_name: str, games):
-    filtered_result = list()
+    genre_match = request.args.get('genre_match', GENRE_MATCH_ANY)
+    if genre_match not in [GENRE_MATCH_ANY, GENRE_MATCH_ALL]:
+        raise NonExistentSearchKeyException(f"{genre_match} is not a valid genre match. Please choose any or all.")
 
-    def has_publisher(game):
-        return game['publisher'].lower() == publisher_name.lower()
+    if term:
+        # Find all games associated with this term: ranked by how well their title, publisher and description match
+        # the term, then the games by publisher and genre, and with a title starting with the term. The repository
+        # applies the filters, using getlist as there can be multiple genres selected
+        search_request = SearchRequest(term,
+                                       publisher=request.args.get('publisher'),
+                                       price_max=price_max,
+                                       genres=request.args.getlist('genres'),
+                                       limit=MAX_FULL_TEXT_MATCHES,
+                                       title_limit=MAX_TITLE_MATCHES,
+                                       match_all_genres=genre_match == GENRE_MATCH_ALL)
+        search_result = search(search_request, repo)
 
-    if len(games):
-        filtered_result = list(filter(has_publisher, games))
+    return search_result
 
-    return filtered_result
+# Count the search results for each genre, publisher and price bucket, for the filter form
+def get_search_facets(search_result, repo: AbstractRepository):
+    facets = repo.get_search_facets([game['game_id'] for game in search_result])
 
-# Filter games by price if the user has chosen to filter by price
-def filter_games_by_price(price: str, games):
-    filtered_result = list()
+    return facets_to_dict(facets)
 
+# Convert a price filter to a number, raising a search key error if it isn't a number at least 0
+def parse_price(price: str) -> float:
     try:
         filter_price = float(price)
-
-        if filter_price < 0:
-            raise NonExistentSearchKeyException(f"{price} is not a valid price. Please input a number greater than 0.")
-        def price_within_range(game):
-            return game['price'] <= filter_price
-
-        if len(games):
-            filtered_result = list(filter(price_within_range, games))
-
-    except:
+    except ValueError:
         raise NonExistentSearchKeyException(f"{price} is not a valid price. Please input a number greater than 0.")
 
-    return filtered_result
-
-# Filter games by genre if the user has chosen to filter by genre
-def filter_games_by_genre(genres: List[str], games):
-    filtered_result = list()
-
-    def matches_genre(game):
-        for genre in genres:
-            if genre.lower() in [g.lower() for g in game['genres']]:
-                return True
-
-        return False
-
-    if len(games):
-        filtered_result = list(filter(matches_genre, games))
+    if filter_price < 0:
+        raise NonExistentSearchKeyException(f"{price} is not a valid price. Please input a number greater than 0.")
 
-    return filtered_result
+    return filter_price
 
 # ============================================
 # Functions to convert model entities to dicts
@@ -140,4 +139,36 @@ def publisher_to_dict(publisher: Publisher):
     return publisher_dict
 
 def publishers_to_dict(publishers: Iterable[Publisher]):
-    return [publisher_to_dict(publisher) for publisher in publishers]
\ No newline at end of file
+    return [publisher_to_dict(publisher) for publisher in publishers]
+
+def facets_to_dict(facets: SearchFacets):
+    facets_dict = {
+        # Most common genres first, and publishers in alphabetical order as in the full publisher list
+        'genres': [{'genre_name': genre_name, 'count': count} for genre_name, count in
+                   sorted(facets.genres.items(), key=lambda genre_count: (-genre_count[1], genre_count[0]))],
+        'publishers': [{'publisher_name': publisher_name, 'count': count} for publisher_name, count in
+                       sorted(facets.publishers.items(), key=lambda publisher_count: publisher_count[0].lower())],
+        'prices': [{'price_max': bound, 'label': price_bucket_label(bound), 'count': count} for bound, count in
+                   sorted(facets.prices.items(), key=lambda price_count: (price_count[0] is None, price_count[0]))],
+    }
+
+    return facets_dict
+
+def price_bucket_label(bound: float | None):
+    if bound is None:
+        return f"Over ${PRICE_BUCKET_BOUNDS[-1]:.2f}"
+    if bound == 0:
+        return "Free"
+
+    # Buckets include their upper bound, so they start a cent above the bound before
+    lower_bound = PRICE_BUCKET_BOUNDS[PRICE_BUCKET_BOUNDS.index(bound) - 1]
+    return f"${lower_bound + 0.01:.2f} - ${bound:.2f}"
+
+def games_with_snippets_to_dict(games_with_snippets: Iterable[Tuple[Game, str]]):
+    game_dicts = list()
+    for game, snippet in games_with_snippets:
+        game_dict = game_to_dict(game)
+        game_dict['snippet'] = highlight_snippet(snippet)
+        game_dicts.append(game_dict)
+
+    return game_dicts
\ No newline at end of file
@@ -1,4 +1,5 @@
 import math
+from typing import List
 
 from flask import request
 
@@ -6,25 +7,9 @@ from games.adapters.repository import AbstractRepository
 from games.domainmodel.model import Genre, Game
 
 
-def get_genres_sorted_by_popularity(repo: AbstractRepository) -> dict[str, int]:
-    # Get all genres and games
-    genres = repo.get_genres()
-    games = repo.get_games()
-
-    # Make a dict that looks like: [{'genre_name': number_of_instances}]
-    genre_names = [genre.genre_name for genre in genres]
-    genreDict = dict.fromkeys(genre_names, 0)
-
-    # Count the number of games with that genre
-    for game in games:
-        for genre in game.genres:
-            genreDict[genre.genre_name] += 1
-
-    # Turn dict into list to sort it
-    genre_list = [[genre_name, genreDict[genre_name]] for genre_name in genreDict.keys()]
-
-    # Sort the list by most popular genre
-    genre_list.sort(key=lambda x: x[1], reverse=True)
+def get_genres_sorted_by_popularity(repo: AbstractRepository, limit: int = None) -> List[dict]:
+    # The repository keeps the genres ranked by their number of games, so there is no need to count them here
+    genre_list = repo.get_genre_popularity(limit)
 
     return genre_tuples_to_dict(genre_list)
 
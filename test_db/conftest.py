@@ -31,6 +31,14 @@ def database_engine():
     yield engine
     metadata.drop_all(engine)
 
+@pytest.fixture
+def database_repo(database_engine):
+    # Repository over the populated test database, with its own session
+    session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
+    repo_instance = database_repository.SqlAlchemyRepository(session_factory)
+    yield repo_instance
+    repo_instance.close_session()
+
 @pytest.fixture
 def session_factory():
     clear_mappers()
@@ -0,0 +1,53 @@
+import pytest
+
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool
+
+from games.adapters.database_engine import create_database_engine
+
+
+def test_database_engine_applies_sqlite_tuning_on_connect(tmp_path):
+    engine = create_database_engine({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "games.db"}',
+        'SQLALCHEMY_POOL_SIZE': 2,
+        'SQLITE_CACHE_SIZE': -2000,
+    })
+
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 2
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        # NORMAL
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+        assert connection.exec_driver_sql('PRAGMA cache_size').scalar() == -2000
+    engine.dispose()
+
+
+def test_database_engine_can_use_configured_pool_without_tuning(tmp_path):
+    engine = create_database_engine({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "games.db"}',
+        'SQLALCHEMY_POOL_CLASS': 'NullPool',
+        'SQLITE_TUNING': False,
+    })
+
+    assert isinstance(engine.pool, NullPool)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'delete'
+
+
+# In-memory databases keep SQLAlchemy's default pool, so every session sees the same database
+def test_database_engine_keeps_default_pool_for_in_memory_sqlite():
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+
+    assert isinstance(engine.pool, SingletonThreadPool)
+    with engine.connect() as connection:
+        connection.exec_driver_sql('CREATE TABLE games (game_id INTEGER PRIMARY KEY)')
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM games').scalar() == 0
+
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLALCHEMY_POOL_CLASS': 'NullPool'})
+    assert isinstance(engine.pool, NullPool)
+
+
+def test_database_engine_rejects_unknown_pool_class():
+    with pytest.raises(ValueError):
+        create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLALCHEMY_POOL_CLASS': 'Pool2000'})
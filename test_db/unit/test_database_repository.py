@@ -0,0 +1,224 @@
+import pytest
+
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker
+
+from games.adapters.database_repository import SqlAlchemyRepository
+from games.adapters.orm import games_table
+from games.adapters.repository import RepositoryException, SearchRequest, SearchFacets
+from games.adapters.search_index import SNIPPET_MATCH_START, SNIPPET_MATCH_END
+from games.browse import services as browse_services
+from games.domainmodel.model import Game, User, make_review
+from test_db.conftest import database_engine, database_repo
+
+
+# Repo returns a single page of games, ordered by title
+def test_repository_retrieves_page_of_games_ordered_by_title(database_repo):
+    page = database_repo.get_games_page(4, 3)
+
+    assert [game.title for game in page] == ["Gladio and Glory", "MURI", "MagicShop3D"]
+    assert database_repo.get_games_page(10, 15) == []
+
+# Repo returns the page after a given (title, game_id) key, matching the offset-based page
+def test_repository_retrieves_games_after_key(database_repo):
+    first_page = database_repo.get_games_page(0, 4)
+    last_game = first_page[-1]
+
+    assert database_repo.get_games_after(last_game.title, last_game.game_id, 3) == database_repo.get_games_page(4, 3)
+    assert database_repo.get_games_after("zzz", 0, 3) == []
+
+# Repo counts the games in the database
+def test_repository_can_get_number_of_games(database_repo):
+    assert database_repo.get_number_of_games() == 10
+
+# Repo counts the games for a genre, using the same lookup modes as retrieving them
+def test_repository_counts_games_for_genre(database_repo):
+    assert database_repo.get_num_games_for_genre("Action") == 10
+    assert database_repo.get_num_games_for_genre("simulation") == 1
+    assert database_repo.get_num_games_for_genre("Acti", prefix_match=False) == 0
+    assert database_repo.get_num_games_for_genre("fake genre name") == 0
+
+# Repo retrieves a single page of the games for a genre, ordered by id
+def test_repository_retrieves_page_of_games_for_genre(database_repo):
+    games = database_repo.get_games_for_genre("Action", offset=3, limit=4)
+
+    assert [game.game_id for game in games] == [4, 5, 6, 7]
+    assert [game.game_id for game in database_repo.get_games_for_genre("Action", offset=8)] == [9, 10]
+    assert database_repo.get_games_for_genre("Simulation", offset=1, limit=4) == []
+
+# Repo ranks genres by their number of games, then by name
+def test_repository_ranks_genres_by_popularity(database_repo):
+    assert database_repo.get_genre_popularity(2) == [("Action", 10), ("Early Access", 1)]
+
+# Repo loads the publisher and genres of listed games up front, so strict loading only rejects other lazy loads
+def test_repository_eager_loads_game_lists(database_engine):
+    session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
+    repo = SqlAlchemyRepository(session_factory, strict_loading=True)
+
+    games = repo.get_games_page(0, 15)
+    assert all("Action" in [genre.genre_name for genre in game.genres] for game in games)
+    assert all(game.publisher is not None for game in games)
+
+    with pytest.raises(InvalidRequestError):
+        games[0].reviews
+
+    repo.close_session()
+
+# Repo orders games by their release date, not by the text of the date
+def test_repository_retrieves_most_recent_games(database_repo):
+    games = database_repo.get_most_recent_games(3)
+
+    assert [(game.game_id, game.release_date) for game in games] == [(5, "Jun 19, 2022"), (10, "Mar 16, 2021"),
+                                                                     (2, "Sep 29, 2020")]
+
+# Repo reports how many objects its session holds, and removing the session empties it
+def test_repository_removing_session_clears_identity_map(database_repo):
+    assert database_repo.get_identity_map_size() == 0
+
+    # The identity map only holds weak references, so keep the loaded games alive
+    games = database_repo.get_games_page(0, 3)
+    assert database_repo.get_identity_map_size() >= len(games)
+
+    database_repo.remove_session()
+    assert database_repo.get_identity_map_size() == 0
+    assert len(database_repo.get_games_page(0, 3)) == 3
+
+# Repo keeps the game's rating aggregates in step with its reviews, and checks for a review without loading them
+def test_repository_maintains_rating_aggregates_for_reviews(database_repo):
+    database_repo.add_user(User("alice", "Password1"))
+    database_repo.add_user(User("bob", "Password1"))
+
+    browse_services.add_review(3, "Great game", 4, "alice", database_repo)
+    browse_services.add_review(3, "Not for me", 1, "bob", database_repo)
+
+    game = database_repo.get_game(3)
+    assert (game.rating_count, game.rating_sum) == (2, 5)
+    assert list(game.rating_histogram) == [0, 1, 0, 0, 1, 0]
+    assert database_repo.has_user_reviewed_game(database_repo.get_user("alice"), game)
+    assert not database_repo.has_user_reviewed_game(database_repo.get_user("alice"), database_repo.get_game(4))
+
+    database_repo.reset_session()
+    browse_services.discard_review(3, "alice", database_repo)
+
+    game = database_repo.get_game(3)
+    assert (game.rating_count, game.rating_sum) == (1, 1)
+    assert not database_repo.has_user_reviewed_game(database_repo.get_user("alice"), game)
+
+
+# Repo rolls back a second review of the same game, leaving the ratings as they were and the session usable
+def test_repository_rejects_second_review_of_game(database_repo):
+    database_repo.add_user(User("alice", "Password1"))
+    browse_services.add_review(3, "Great game", 4, "alice", database_repo)
+    alice, game = database_repo.get_user("alice"), database_repo.get_game(3)
+    # Load the reviews first, so making the duplicate doesn't autoflush it before it reaches the repo
+    assert len(alice.reviews) == len(game.reviews) == 1
+
+    with pytest.raises(RepositoryException):
+        database_repo.add_review(make_review("Changed my mind", 1, alice, game))
+
+    assert (game.rating_count, game.rating_sum) == (1, 4)
+    assert [review.comment for review in game.reviews] == ["Great game"]
+    assert [review.comment for review in database_repo.get_reviews(alice)] == ["Great game"]
+
+# Repo lists and pages through favourites in the order they were added, as the memory repository does
+def test_repository_retrieves_favourites_in_order_added(database_repo):
+    database_repo.add_user(User("alice", "Password1"))
+    alice = database_repo.get_user("alice")
+    for game_id in [7, 2, 9, 4]:
+        database_repo.add_game_to_favourites(alice, database_repo.get_game(game_id))
+
+    assert [game.game_id for game in database_repo.get_favourites(alice)] == [7, 2, 9, 4]
+    assert [game.game_id for game in database_repo.get_favourites(alice, 1, 2)] == [2, 9]
+
+    database_repo.reset_session()
+    assert [game.game_id for game in database_repo.get_user("alice").favourite_games] == [7, 2, 9, 4]
+
+# Repo pages through a user's reviews by the time they were posted, most recent first
+def test_repository_retrieves_reviews_for_user_by_time_posted(database_repo):
+    database_repo.add_user(User("alice", "Password1"))
+    database_repo.add_user(User("bob", "Password1"))
+    alice = database_repo.get_user("alice")
+    assert database_repo.get_most_recent_review(alice) is None
+
+    for game_id, time_posted in [(1, "Jan 02, 2023 at 10:00:00"), (2, "Mar 01, 2023 at 09:30:00"),
+                                 (3, "Feb 14, 2023 at 18:45:10")]:
+        review = make_review(f"Review of game {game_id}", 3, alice, database_repo.get_game(game_id))
+        review._Review__time_posted = time_posted
+        database_repo.add_review(review)
+    browse_services.add_review(4, "Bob's review", 2, "bob", database_repo)
+
+    reviews = database_repo.get_reviews(alice)
+    assert [review.game.game_id for review in reviews] == [2, 3, 1]
+    assert reviews[0].time_posted == "Mar 01, 2023 at 09:30:00"
+    assert [review.game.game_id for review in database_repo.get_reviews(alice, 1, 1)] == [3]
+    assert database_repo.get_most_recent_review(alice).game.game_id == 2
+
+# Repo ranks games by how well their title, publisher or description match the search words
+def test_repository_searches_games(database_repo):
+    assert [game.game_id for game in database_repo.search_games("princess")] == [5]
+    assert [game.game_id for game in database_repo.search_games("ACTIVISION duty")] == [1]
+    assert database_repo.search_games("the") == []
+    assert database_repo.search_games("nonexistent words") == []
+
+    first_page = database_repo.search_games("action", limit=3)
+    assert len(first_page) == 3
+    assert database_repo.search_games("action", limit=3, offset=3) == database_repo.search_games("action", 6)[3:]
+
+    game, snippet = database_repo.search_games_with_snippets("princess")[0]
+    assert game.game_id == 5
+    assert f"{SNIPPET_MATCH_START}princess{SNIPPET_MATCH_END}" in snippet.lower()
+
+# Repo filters the games matching a search request in its queries
+def test_repository_searches_games_with_filters(database_repo):
+    results = database_repo.search(SearchRequest("action"))
+    assert [game.game_id for game, snippet in results if snippet] == [7, 1, 9]
+    assert len(results) == 10
+    # Games in the genre are capped like title matches, counting those already found by full-text search
+    results = database_repo.search(SearchRequest("action", title_limit=2))
+    assert [game.game_id for game, _ in results] == [7, 1, 9, 2]
+
+    results = database_repo.search(SearchRequest("action", price_max=10))
+    assert [game.game_id for game, _ in results] == [1, 9, 3, 5, 10]
+
+    results = database_repo.search(SearchRequest("action", publisher="ACTIVISION", genres=["indie", "action"]))
+    assert [game.game_id for game, _ in results] == [1]
+
+    results = database_repo.search(SearchRequest("action", price_max=10, limit=1))
+    assert [game.game_id for game, snippet in results if snippet] == [1]
+
+    assert database_repo.search(SearchRequest("action", genres=["Nonexistent"])) == []
+
+    assert database_repo.search(SearchRequest("action", genres=["indie", "Nonexistent"], match_all_genres=True)) == []
+    results = database_repo.search(SearchRequest("action", genres=["indie", "action"], match_all_genres=True))
+    assert [game.game_id for game, _ in results] == [10]
+
+# Repo counts the games in a set of results with grouped queries, matching the memory repository
+def test_repository_counts_search_facets(database_repo):
+    facets = database_repo.get_search_facets([1, 3, 5, 7, 10, 99])
+
+    assert facets.genres == {'Action': 5, 'Early Access': 1, 'Free to Play': 1, 'Indie': 1, 'Simulation': 1,
+                             'Strategy': 1}
+    assert facets.publishers == {'Activision': 1, 'Adi Zhavo': 1, 'Buka Entertainment': 1, 'FireArmGames': 1,
+                                 'KOEI TECMO GAMES CO., LTD.': 1}
+    assert facets.prices == {0.0: 1, 10.0: 3, 50.0: 1}
+    assert database_repo.get_search_facets([]) == SearchFacets()
+
+# The full-text index follows games as they're added, changed and removed
+def test_full_text_index_is_kept_in_sync_with_games(database_repo):
+    game = Game(11, "Shadow Princess")
+    game.description = "A princess game"
+    game.price = 0
+    game.release_date = "Oct 21, 2008"
+    game.publisher = database_repo.get_publishers()[0]
+    database_repo.add_game(game)
+
+    assert [game.game_id for game in database_repo.search_games("princess")] == [11, 5]
+
+    session = database_repo._session_cm.session
+    session.execute(games_table.update().where(games_table.c.game_id == 11).values(game_title="Shadow Knight"))
+    session.execute(games_table.update().where(games_table.c.game_id == 5).values(game_description="No match"))
+    assert [game.game_id for game in database_repo.search_games("princess")] == [11]
+    assert [game.game_id for game in database_repo.search_games("knight")] == [11]
+
+    session.execute(games_table.delete().where(games_table.c.game_id == 11))
+    assert database_repo.search_games("princess") == []
@@ -1,8 +1,11 @@
 import pytest
 from games.domainmodel.model import Publisher, Genre, Game, User, Review, Wishlist
 from test_db.conftest import empty_session
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.exc import IntegrityError
 
+from games.adapters.orm import metadata, upgrade_schema, GAMES_FTS_TABLE, SCHEMA_VERSION
+
 def insert_user(empty_session, values=None):
     new_name = "Andrew"
     new_password = "Watermelon123"
@@ -15,4 +18,73 @@ def insert_user(empty_session, values=None):
                           {'user_name': new_name, 'password': new_password})
     row = empty_session.execute('SELECT id from users where user_name = :user_name',
                                 {'user_name': new_name}).fetchone()
-    return row[0]
\ No newline at end of file
+    return row[0]
+
+
+def test_upgrade_schema_adds_missing_columns_and_indexes():
+    engine = create_engine('sqlite://')
+    # A games table created before the rating aggregates and indexes were introduced
+    engine.execute('CREATE TABLE games (game_id INTEGER PRIMARY KEY, game_title TEXT NOT NULL, '
+                   'game_price FLOAT NOT NULL, release_date VARCHAR(10) NOT NULL, game_description VARCHAR(255), '
+                   'game_image_url VARCHAR(255), game_website_url VARCHAR(255), publisher_name VARCHAR(255))')
+    engine.execute("INSERT INTO games (game_id, game_title, game_price, release_date) VALUES (1, 'Muri', 0, 'Oct 21, 2008')")
+
+    upgrade_schema(engine)
+    upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    table_names = inspector.get_table_names()
+    assert sorted(name for name in table_names if not name.startswith(GAMES_FTS_TABLE)) == sorted(metadata.tables)
+    assert {'rating_count', 'rating_sum', 'rating_histogram'} <= {column['name'] for column in
+                                                                   inspector.get_columns('games')}
+    assert engine.execute("SELECT name FROM sqlite_master WHERE name = 'ix_games_game_title_lower'").fetchone()
+    # The full-text index is created and filled from the existing games
+    assert engine.execute("SELECT rowid FROM games_fts WHERE games_fts MATCH 'muri'").fetchall() == [(1,)]
+    assert engine.execute('SELECT rating_count, rating_sum FROM games').fetchone() == (0, 0)
+    # Release dates stored as text are rewritten as dates, once
+    assert engine.execute('SELECT release_date FROM games').fetchone() == ('2008-10-21',)
+    assert engine.execute('PRAGMA user_version').scalar() == SCHEMA_VERSION
+
+    engine.execute("UPDATE games SET release_date = 'Oct 21, 2008'")
+    upgrade_schema(engine)
+    assert engine.execute('SELECT release_date FROM games').fetchone() == ('Oct 21, 2008',)
+
+    username_index = [index for index in inspector.get_indexes('users') if index['column_names'] == ['username']]
+    assert username_index[0]['unique']
+
+
+# Games reviewed before the rating aggregates were stored get them from their reviews
+def test_upgrade_schema_fills_rating_aggregates_from_existing_reviews():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE games (game_id INTEGER PRIMARY KEY, game_title TEXT NOT NULL, '
+                   'game_price FLOAT NOT NULL, release_date VARCHAR(10) NOT NULL, game_description VARCHAR(255), '
+                   'game_image_url VARCHAR(255), game_website_url VARCHAR(255), publisher_name VARCHAR(255))')
+    engine.execute('CREATE TABLE review (review_id INTEGER PRIMARY KEY, comment TEXT NOT NULL, '
+                   'user_id INTEGER NOT NULL, game_id INTEGER NOT NULL, time_posted VARCHAR NOT NULL, '
+                   'rating INTEGER NOT NULL)')
+    engine.execute("INSERT INTO games (game_id, game_title, game_price, release_date) VALUES "
+                   "(3010, 'Xpand Rally', 9.99, 'Oct 21, 2008'), (3011, 'Muri', 0, 'Oct 21, 2008')")
+    engine.execute("INSERT INTO review (comment, user_id, game_id, time_posted, rating) VALUES "
+                   "('Great', 1, 3010, 'Jan 02, 2023 at 10:00:00', 5), "
+                   "('Fine', 2, 3010, 'Jan 03, 2023 at 10:00:00', 3), "
+                   "('Also great', 3, 3010, 'Jan 04, 2023 at 10:00:00', 5)")
+
+    upgrade_schema(engine)
+
+    rows = engine.execute('SELECT game_id, rating_count, rating_sum, rating_histogram FROM games ORDER BY game_id')
+    assert rows.fetchall() == [(3010, 3, 13, '[0, 0, 0, 1, 0, 2]'), (3011, 0, 0, '[0, 0, 0, 0, 0, 0]')]
+
+
+# Favourites added before they were numbered keep the order they were added in
+def test_upgrade_schema_numbers_existing_favourites():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE user_favourite_games (username VARCHAR(255), game_id INTEGER, '
+                   'PRIMARY KEY (username, game_id))')
+    engine.execute("INSERT INTO user_favourite_games VALUES ('alice', 7), ('alice', 2), ('bob', 5)")
+
+    upgrade_schema(engine)
+    engine.execute("INSERT INTO user_favourite_games (username, game_id, position) "
+                   "SELECT 'alice', 1, MAX(position) + 1 FROM user_favourite_games")
+
+    assert engine.execute("SELECT game_id FROM user_favourite_games WHERE username = 'alice' "
+                          "ORDER BY position").fetchall() == [(7,), (2,), (1,)]
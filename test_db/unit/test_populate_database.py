@@ -1,17 +1,21 @@
-from sqlalchemy import select, inspect
-from test_db.conftest import database_engine
+from sqlalchemy import select, inspect, create_engine
+from test_db.conftest import database_engine, TEST_DATA_PATH_DATABASE_LIMITED
 from games.adapters.orm import metadata
+from games.adapters.repository_populate import populate_database
 
 def test_database_populate_inspect_table_names(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    assert inspector.get_table_names() == ['games', 'games_genres', 'genres', 'publishers', 'review', 'user_favourite_games', 'users']
+    # The full-text index over games is an FTS5 virtual table, stored in its own shadow tables
+    assert inspector.get_table_names() == ['games', 'games_fts', 'games_fts_config', 'games_fts_data',
+                                           'games_fts_docsize', 'games_fts_idx', 'games_genres', 'genres',
+                                           'publishers', 'review', 'user_favourite_games', 'users']
 
 def test_database_populate_select_all_users(database_engine):
 
     # Get table information
     inspector = inspect(database_engine)
-    name_of_users_table = inspector.get_table_names()[6]
+    name_of_users_table = inspector.get_table_names()[11]
 
     with database_engine.connect() as connection:
         # query for records in table users
@@ -22,4 +26,22 @@ def test_database_populate_select_all_users(database_engine):
         for row in result:
             all_users.append(row['username'])
 
-        assert all_users == ['jess', 'milton', 'david', 'alpc']
\ No newline at end of file
+        assert all_users == ['jess', 'milton', 'david', 'alpc']
+
+def test_database_bulk_populate_inserts_all_rows():
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+
+    # Small batches so the games are inserted over several executemany calls
+    num_rows, elapsed = populate_database(TEST_DATA_PATH_DATABASE_LIMITED, engine, batch_size=3)
+
+    counts = {table: engine.execute(f'SELECT COUNT(*) FROM {table}').scalar()
+              for table in ['publishers', 'genres', 'games', 'games_genres']}
+    assert counts == {'publishers': 10, 'genres': 6, 'games': 10, 'games_genres': 15}
+    assert num_rows == sum(counts.values())
+    assert elapsed > 0
+    assert engine.execute('SELECT release_date, rating_count FROM games WHERE game_id = 5').fetchone() == \
+           ('2022-06-19', 0)
+    # The full-text index is rebuilt after the load, and its triggers restored
+    assert engine.execute("SELECT rowid FROM games_fts WHERE games_fts MATCH 'princess'").fetchall() == [(5,)]
+    assert engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").scalar() == 3
@@ -57,6 +57,9 @@ def test_search(client):
     # Try to search something with hits
     response = client.get("/search?term=call", follow_redirects=True)
     assert b'Call of Duty' in response.data
+    # The filter form counts the results for each publisher, genre and price range
+    assert b'Activision (1)' in response.data
+    assert b'$0.01 - $10.00 (1)' in response.data
 
 
 # Test registration
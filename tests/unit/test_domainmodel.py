@@ -309,6 +309,24 @@ def test_user_add_remove_favourite_games():
     assert repr(user1.favourite_games) == "[<Game 3, Fat City>]"
 
 
+def test_user_favourite_games_keep_insertion_order():
+    user1 = User("Shyamli", "pw12345")
+    games = [Game(game_id, f"Game {game_id}") for game_id in [5, 2, 9, 1]]
+    assert user1.most_recent_favourite_game is None
+
+    for game in games:
+        user1.add_favourite_game(game)
+
+    assert user1.number_of_favourite_games == 4
+    assert user1.most_recent_favourite_game is games[3]
+    assert user1.has_favourite_game(Game(9, "Game 9"))
+    assert user1.get_favourite_games_page(1, 2) == [games[1], games[2]]
+
+    user1.remove_favourite_game(Game(2, "Game 2"))
+    assert not user1.has_favourite_game(games[1])
+    assert user1.favourite_games == [games[0], games[2], games[3]]
+
+
 def test_user_add_remove_reviews():
     user = User("Shyamli", "pw12345")
     game = Game(1, "Domino Game")
@@ -383,6 +401,34 @@ def test_delete_review_method():
     assert len(game.reviews) == 0
     assert len(user.reviews) == 0
 
+def test_game_rating_aggregates():
+    user = User("Shyamli", "pw12345")
+    game = Game(1, "Domino Game")
+
+    assert game.rating_count == 0
+    assert game.average_rating is None
+    assert game.rating_histogram == (0, 0, 0, 0, 0, 0)
+
+    review1 = make_review("Great game!", 3, user, game)
+    make_review("Splendid game!", 2, user, game)
+    make_review("Splendid game!", 2, user, game)
+    assert game.rating_count == 2
+    assert game.rating_sum == 5
+    assert game.average_rating == 2.5
+    assert game.rating_histogram == (0, 0, 1, 1, 0, 0)
+
+    # Changing the rating of an attached review moves it between ratings
+    review1.rating = 0
+    assert game.rating_count == 2
+    assert game.rating_sum == 2
+    assert game.rating_histogram == (1, 0, 1, 0, 0, 0)
+
+    delete_review(review1)
+    delete_review(review1)
+    assert game.rating_count == 1
+    assert game.average_rating == 2
+    assert game.rating_histogram == (0, 0, 1, 0, 0, 0)
+
 def test_review_initialization():
     user = User("Shyamli", "pw12345")
     game = Game(1, "Domino Game")
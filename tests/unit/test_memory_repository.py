@@ -2,7 +2,9 @@ from datetime import datetime
 
 import pytest
 
-from games.domainmodel.model import Game, Publisher, Genre, User, Review
+from games.adapters.repository import RepositoryException, SearchRequest, SearchFacets
+from games.adapters.search_index import SNIPPET_MATCH_START, SNIPPET_MATCH_END
+from games.domainmodel.model import Game, Publisher, Genre, User, Review, make_review, delete_review
 
 test_game_id = 11
 test_game_title = "Test Game"
@@ -54,6 +56,24 @@ def test_repository_can_retrieve_a_game(in_memory_repo):
     game = in_memory_repo.get_game(1)
     assert game.title == "Call of Duty® 4: Modern Warfare®"
 
+# Repo replaces a Game that has the same id as an existing Game, rather than storing both
+def test_repository_replaces_game_with_same_id(in_memory_repo):
+    replacement = Game(1, "Replacement Game")
+    in_memory_repo.add_game(replacement)
+
+    assert in_memory_repo.get_number_of_games() == 10
+    assert in_memory_repo.get_game(1) is replacement
+    assert in_memory_repo.get_games()[0] is replacement
+
+# Repo can remove a Game, after which it can no longer be retrieved by id
+def test_repository_can_remove_a_game(in_memory_repo):
+    game = in_memory_repo.get_game(1)
+    in_memory_repo.remove_game(game)
+
+    assert in_memory_repo.get_game(1) is None
+    assert in_memory_repo.get_number_of_games() == 9
+    assert game not in in_memory_repo.get_games()
+
 # Repo returns Mone if game_id is invalid
 def test_repository_does_not_retrieve_a_non_existent_game(in_memory_repo):
     game = in_memory_repo.get_game('not an id')
@@ -75,6 +95,31 @@ def test_repository_can_retrieve_list_of_games(in_memory_repo):
     assert games[0] == Game(1, 'Test')
     assert games[1] == Game(2, 'Test two')
 
+# Repo returns a single page of games in title order without sorting its list of games
+def test_repository_retrieves_page_of_games_ordered_by_title(in_memory_repo):
+    page = in_memory_repo.get_games_page(4, 3)
+
+    assert [game.title for game in page] == ["Gladio and Glory", "MURI", "MagicShop3D"]
+    assert in_memory_repo.get_games()[0].game_id == 1
+    assert len(in_memory_repo.get_games_page(9, 15)) == 1
+    assert in_memory_repo.get_games_page(10, 15) == []
+
+# Repo can also page through games in id order, but not in an unknown order
+def test_repository_retrieves_page_of_games_ordered_by_id(in_memory_repo):
+    page = in_memory_repo.get_games_page(2, 2, order_by='game_id')
+
+    assert [game.game_id for game in page] == [3, 4]
+
+    with pytest.raises(RepositoryException):
+        in_memory_repo.get_games_page(0, 2, order_by='price')
+
+# Repo returns the games after a given (title, game_id) key, matching the offset-based page
+def test_repository_retrieves_games_after_key(in_memory_repo):
+    last_game = in_memory_repo.get_games_page(0, 4)[-1]
+
+    assert in_memory_repo.get_games_after(last_game.title, last_game.game_id, 3) == in_memory_repo.get_games_page(4, 3)
+    assert in_memory_repo.get_games_after("zzz", 0, 3) == []
+
 # Repo can add a Genre
 def test_repository_can_add_a_genre(in_memory_repo, test_genre):
     in_memory_repo.add_genre(test_genre)
@@ -133,6 +178,141 @@ def test_repository_gets_number_of_games_for_genre(in_memory_repo):
 
     assert len(games) is 10
 
+# Repo can count games for a genre without building the list of games, using the same lookup modes
+def test_repository_counts_games_for_genre(in_memory_repo):
+    assert in_memory_repo.get_num_games_for_genre("Action") == 10
+    assert in_memory_repo.get_num_games_for_genre("simulation") == 1
+    assert in_memory_repo.get_num_games_for_genre("Acti") == 10
+    assert in_memory_repo.get_num_games_for_genre("Acti", prefix_match=False) == 0
+    assert in_memory_repo.get_num_games_for_genre("fake genre name") == 0
+
+# Repo only matches the whole genre name when prefix matching is turned off
+def test_repository_retrieves_games_for_exact_genre_name(in_memory_repo):
+    assert len(in_memory_repo.get_games_for_genre("action", prefix_match=False)) == 10
+    assert in_memory_repo.get_games_for_genre("Acti", prefix_match=False) == []
+
+# Repo ranks games by how well their title, publisher and description match the search words
+def test_repository_ranks_games_matching_search_words(in_memory_repo, test_game):
+    assert [game.game_id for game in in_memory_repo.search_games("princess")] == [5]
+    assert [game.game_id for game in in_memory_repo.search_games("ACTIVISION duty")] == [1]
+    assert in_memory_repo.search_games("the") == []
+    assert in_memory_repo.search_games("nonexistent words") == []
+
+    # A match in the title counts for more than a match in the description
+    test_game.description = "A princess game"
+    test_game.title = "Shadow Princess"
+    in_memory_repo.add_game(test_game)
+
+    assert [game.game_id for game in in_memory_repo.search_games("princess")] == [test_game_id, 5]
+    assert in_memory_repo.search_games("princess", limit=1) == [test_game]
+
+    in_memory_repo.remove_game(test_game)
+
+    assert [game.game_id for game in in_memory_repo.search_games("princess")] == [5]
+
+    # Games with equal scores are ranked by id, whichever was added first
+    for game_id in [13, 12]:
+        in_memory_repo.add_game(Game(game_id, "Princess Quest"))
+    assert [game.game_id for game in in_memory_repo.search_games("princess", limit=1)] == [12]
+    assert [game.game_id for game in in_memory_repo.search_games("princess quest")] == [12, 13, 5]
+
+# Repo pages through search results and pairs each game with a snippet of its description
+def test_repository_retrieves_page_of_search_results_with_snippets(in_memory_repo):
+    first_page = in_memory_repo.search_games("action", limit=3)
+    assert in_memory_repo.search_games("action", limit=3, offset=3) == in_memory_repo.search_games("action", 6)[3:]
+    assert in_memory_repo.search_games("action", limit=3, offset=100) == []
+
+    game, snippet = in_memory_repo.search_games_with_snippets("princess")[0]
+    assert game.game_id == 5
+    assert f"{SNIPPET_MATCH_START}princess{SNIPPET_MATCH_END}" in snippet.lower()
+    assert [game for game, _ in in_memory_repo.search_games_with_snippets("action", limit=3)] == first_page
+
+# Repo applies the filters of a search request while finding the games matching its term
+def test_repository_searches_games_with_filters(in_memory_repo):
+    results = in_memory_repo.search(SearchRequest("action"))
+    # Full-text matches, with snippets, come before the other games in the Action genre
+    assert [game.game_id for game, snippet in results if snippet] == [7, 1, 9]
+    assert len(results) == 10
+    # Games in the genre are capped like title matches, counting those already found by full-text search
+    results = in_memory_repo.search(SearchRequest("action", title_limit=2))
+    assert [game.game_id for game, _ in results] == [7, 1, 9, 2]
+
+    results = in_memory_repo.search(SearchRequest("action", price_max=10))
+    assert [game.game_id for game, _ in results] == [1, 9, 3, 5, 10]
+
+    results = in_memory_repo.search(SearchRequest("action", publisher="ACTIVISION", genres=["indie", "action"]))
+    assert [game.game_id for game, _ in results] == [1]
+
+    # Full-text matches failing the filters don't take up the limit
+    results = in_memory_repo.search(SearchRequest("action", price_max=10, limit=1))
+    assert [game.game_id for game, snippet in results if snippet] == [1]
+
+    assert in_memory_repo.search(SearchRequest("action", genres=["Nonexistent"])) == []
+
+    # Either any or all of the genres must match
+    results = in_memory_repo.search(SearchRequest("action", genres=["indie", "Nonexistent"]))
+    assert [game.game_id for game, _ in results] == [10]
+    assert in_memory_repo.search(SearchRequest("action", genres=["indie", "Nonexistent"], match_all_genres=True)) == []
+    results = in_memory_repo.search(SearchRequest("action", genres=["indie", "action"], match_all_genres=True))
+    assert [game.game_id for game, _ in results] == [10]
+    assert in_memory_repo.search(SearchRequest("  ", publisher="Activision")) == []
+
+# Repo counts the games in a set of results for each genre, publisher and price bucket
+def test_repository_counts_search_facets(in_memory_repo):
+    facets = in_memory_repo.get_search_facets([1, 3, 5, 7, 10, 99])
+
+    assert facets.genres == {'Action': 5, 'Early Access': 1, 'Free to Play': 1, 'Indie': 1, 'Simulation': 1,
+                             'Strategy': 1}
+    assert facets.publishers == {'Activision': 1, 'Adi Zhavo': 1, 'Buka Entertainment': 1, 'FireArmGames': 1,
+                                 'KOEI TECMO GAMES CO., LTD.': 1}
+    assert facets.prices == {0.0: 1, 10.0: 3, 50.0: 1}
+    assert in_memory_repo.get_search_facets([]) == SearchFacets()
+
+    in_memory_repo.remove_game(in_memory_repo.get_game(10))
+    assert in_memory_repo.get_search_facets([10]) == SearchFacets()
+
+# Repo retrieves a single page of the games for a genre, ordered by id
+def test_repository_retrieves_page_of_games_for_genre(in_memory_repo):
+    games = in_memory_repo.get_games_for_genre("Action", offset=3, limit=4)
+
+    assert [game.game_id for game in games] == [4, 5, 6, 7]
+    assert [game.game_id for game in in_memory_repo.get_games_for_genre("Action", offset=8)] == [9, 10]
+    assert in_memory_repo.get_games_for_genre("Simulation", offset=1, limit=4) == []
+
+# Repo keeps the games for a genre ordered by id as games are added and removed
+def test_repository_keeps_games_for_genre_in_sync(in_memory_repo, test_game):
+    genre = in_memory_repo.get_genre("Simulation")
+    test_game.add_genre(genre)
+    in_memory_repo.add_game(test_game)
+
+    games = in_memory_repo.get_games_for_genre("Simulation")
+    assert [game.game_id for game in games] == [10, test_game_id]
+
+    in_memory_repo.remove_game(in_memory_repo.get_game(10))
+
+    assert in_memory_repo.get_games_for_genre("Simulation") == [test_game]
+    assert in_memory_repo.get_num_games_for_genre("Action") == 9
+
+# Repo ranks genres by their number of games, then by name
+def test_repository_ranks_genres_by_popularity(in_memory_repo):
+    popularity = in_memory_repo.get_genre_popularity()
+
+    assert popularity[0] == ("Action", 10)
+    assert popularity[1] == ("Early Access", 1)
+    assert len(popularity) == 6
+    assert in_memory_repo.get_genre_popularity(2) == popularity[0:2]
+
+# Repo updates the genre ranking when games are added
+def test_repository_updates_genre_popularity(in_memory_repo, test_game):
+    test_game.add_genre(Genre("Strategy"))
+    in_memory_repo.add_game(test_game)
+
+    assert in_memory_repo.get_genre_popularity(2) == [("Action", 10), ("Strategy", 2)]
+
+    in_memory_repo.remove_game(test_game)
+
+    assert in_memory_repo.get_genre_popularity(2) == [("Action", 10), ("Early Access", 1)]
+
 # Repo can add a publisher
 def test_repository_can_add_a_publisher(in_memory_repo, test_publisher):
     in_memory_repo.add_publisher(test_publisher)
@@ -172,6 +352,20 @@ def test_repository_retrieves_games_even_if_publisher_name_is_incomplete(in_memo
     assert games[0].game_id is 1
     assert games[0].title == "Call of Duty® 4: Modern Warfare®"
 
+# Repo matches publishers by name rather than by object identity, ignoring case
+def test_repository_retrieves_games_for_publisher_with_separate_publisher_object(in_memory_repo, test_game):
+    test_game.publisher = Publisher("ACTIVISION")
+    in_memory_repo.add_game(test_game)
+
+    games = in_memory_repo.get_games_for_publisher("activision")
+
+    assert [game.game_id for game in games] == [1, test_game_id]
+    assert in_memory_repo.get_publisher("aCtIvIsIoN").publisher_name == "Activision"
+
+# Repo returns an empty list if no publisher starts with the given string
+def test_repository_returns_no_games_for_unknown_publisher(in_memory_repo):
+    assert in_memory_repo.get_games_for_publisher("Nonexistent publisher") == []
+
 # Repo can retrieve game with a given title
 def test_repository_retrieves_game_with_given_title(in_memory_repo, test_game):
     in_memory_repo.add_game(test_game)
@@ -184,6 +378,23 @@ def test_repository_retrieves_game_with_incomplete_title(in_memory_repo, test_ga
 
     assert in_memory_repo.get_game_from_title(test_game_title[0:5]) is test_game
 
+# Repo returns every game whose title starts with the given string, ordered by title then id
+def test_repository_retrieves_ranked_games_with_title_prefix(in_memory_repo):
+    in_memory_repo.add_game(Game(12, "Murder Mystery"))
+    in_memory_repo.add_game(Game(11, "muri"))
+
+    games = in_memory_repo.get_games_from_title("MU")
+
+    assert [game.game_id for game in games] == [12, 9, 11]
+    assert in_memory_repo.get_games_from_title("mu", limit=2) == games[0:2]
+    assert in_memory_repo.get_game_from_title("mu") is games[0]
+
+# Repo no longer finds a game by title once it has been removed
+def test_repository_does_not_retrieve_removed_game_by_title(in_memory_repo):
+    in_memory_repo.remove_game(in_memory_repo.get_game(9))
+
+    assert in_memory_repo.get_games_from_title("MURI") == []
+
 # Repo returns None if the title is invalid
 def test_repository_returns_none_if_game_with_title_does_not_exist(in_memory_repo):
     assert in_memory_repo.get_game_from_title("doesn't exist") is None
@@ -200,6 +411,28 @@ def test_repository_retrieves_three_most_recent_games(in_memory_repo):
     assert datetime.strptime(games[0].release_date, date_format) > datetime.strptime(games[1].release_date, date_format)
     assert datetime.strptime(games[1].release_date, date_format) > datetime.strptime(games[2].release_date, date_format)
 
+# Repo retrieves the n most recent games without re-ordering its list of games
+def test_repository_retrieves_n_most_recent_games(in_memory_repo, test_game):
+    # A game without a release date is never one of the most recent games
+    in_memory_repo.add_game(test_game)
+
+    games = in_memory_repo.get_most_recent_games(5)
+
+    assert [game.game_id for game in games] == [5, 10, 2, 7, 6]
+    assert [game.game_id for game in in_memory_repo.get_games()] == list(range(1, 12))
+    assert in_memory_repo.get_most_recent_games(0) == []
+
+# Repo updates the most recent games when a game is added or removed
+def test_repository_keeps_most_recent_games_in_sync(in_memory_repo, test_game):
+    test_game.release_date = "Jan 1, 2023"
+    in_memory_repo.add_game(test_game)
+
+    assert in_memory_repo.get_most_recent_games(2) == [test_game, in_memory_repo.get_game(5)]
+
+    in_memory_repo.remove_game(test_game)
+
+    assert in_memory_repo.get_most_recent_games(1) == [in_memory_repo.get_game(5)]
+
 def test_repository_populates_variables_using_dataset(in_memory_repo):
     games = in_memory_repo.get_games()
     genres = in_memory_repo.get_genres()
@@ -248,6 +481,21 @@ def test_repository_can_add_review(in_memory_repo, test_review, test_user, test_
     assert review is test_review
 
 
+# Repo knows whether a user has reviewed a game, and rejects a second review of the same game
+def test_repository_rejects_second_review_of_game(in_memory_repo, test_review, test_user, test_game):
+    assert not in_memory_repo.has_user_reviewed_game(test_user, test_game)
+
+    in_memory_repo.add_review(test_review)
+
+    assert in_memory_repo.has_user_reviewed_game(test_user, test_game)
+    rating_aggregates = (test_game.rating_count, test_game.rating_sum, tuple(test_game.rating_histogram))
+    with pytest.raises(RepositoryException):
+        in_memory_repo.add_review(make_review("Another review", 1, test_user, test_game))
+    assert in_memory_repo.get_user_review_for_game(test_user, test_game) is test_review
+    # The rejected review is detached again, leaving the game's ratings as they were
+    assert test_game.reviews == [test_review] and test_user.reviews == [test_review]
+    assert (test_game.rating_count, test_game.rating_sum, tuple(test_game.rating_histogram)) == rating_aggregates
+
 # Repo can remove review
 def test_repository_can_remove_review(in_memory_repo, test_user, test_game, test_review):
     in_memory_repo.add_review(test_review)
@@ -260,6 +508,32 @@ def test_repository_can_remove_review(in_memory_repo, test_user, test_game, test
 
     assert len(in_memory_repo.get_reviews()) == 6
 
+# Repo only returns the given user's reviews, most recent first
+def test_repository_retrieves_reviews_for_user(in_memory_repo, test_user, test_game):
+    other_user = User("otheruser", "TestPassword9")
+    other_game = in_memory_repo.get_game(1)
+    in_memory_repo.add_user(test_user)
+    in_memory_repo.add_user(other_user)
+
+    first_review = make_review("First review", 4, test_user, test_game)
+    in_memory_repo.add_review(first_review)
+    in_memory_repo.add_review(make_review("Other user's review", 2, other_user, test_game))
+    second_review = make_review("Second review", 3, test_user, other_game)
+    in_memory_repo.add_review(second_review)
+
+    assert in_memory_repo.get_reviews(test_user) == [second_review, first_review]
+    assert in_memory_repo.get_reviews(test_user, 1, 5) == [first_review]
+    assert in_memory_repo.get_most_recent_review(test_user) is second_review
+    assert in_memory_repo.get_user_review_for_game(test_user, other_game) is second_review
+    assert in_memory_repo.get_user_review_for_game(other_user, other_game) is None
+
+    delete_review(second_review)
+    in_memory_repo.remove_review(second_review)
+
+    assert in_memory_repo.get_reviews(test_user) == [first_review]
+    assert in_memory_repo.get_user_review_for_game(test_user, other_game) is None
+    assert in_memory_repo.get_most_recent_review(other_user).comment == "Other user's review"
+
 # Repo adds a valid favourite game to the user's list of favourites
 def test_repository_adds_favourite_game(in_memory_repo, test_game):
     user = in_memory_repo.get_user("jess")
@@ -3,11 +3,12 @@ import pytest
 from flask import request
 
 from games import create_app
+from games.adapters.repository import SearchRequest
 from datetime import date
 
 from games.authentication.services import AuthenticationException, UnknownUserException
 from games.browse import services as games_services
-from games.domainmodel.model import Game, User, Review
+from games.domainmodel.model import Game, User, Review, make_review
 from games.genres import services as genres_services
 from games.home import services as home_services
 from games.search.services import NonExistentSearchKeyException
@@ -65,6 +66,11 @@ def test_sort_games_alphabetically(in_memory_repo):
         if idx != len(games) - 1:
             assert games[idx].title < games[idx + 1].title
 
+    # Sorting the games doesn't reorder the repository's own list
+    assert in_memory_repo.get_games()[0].game_id == 1
+    games_services.get_games(in_memory_repo)
+    assert [game.game_id for game in in_memory_repo.get_games()] == list(range(1, 11))
+
 
 # Test correct indices of games (sorted alphabetically by default) can be retrieved for pagination purposes
 def test_can_get_games_for_page(in_memory_repo):
@@ -86,6 +92,16 @@ def test_can_get_games_for_page(in_memory_repo):
     for idx, game in enumerate(page_three):
         assert game.get('title') is games[idx + 4].title
 
+# Test the next page can be retrieved from the id of the last game on the previous page
+def test_can_get_games_for_page_after_game(in_memory_repo):
+    page_one = games_services.get_games_for_page(1, 3, in_memory_repo)
+    page_two = games_services.get_games_for_page(2, 3, in_memory_repo)
+
+    assert games_services.get_games_for_page(2, 3, in_memory_repo, page_one[-1]['game_id']) == page_two
+
+    # An unknown game id falls back to the page number
+    assert games_services.get_games_for_page(2, 3, in_memory_repo, 900) == page_two
+
 # Test can add review
 def test_add_review(in_memory_repo):
     test_game_id = 3
@@ -168,6 +184,21 @@ def test_calculate_average_rating(in_memory_repo):
     assert games_services.calculate_average_rating_for_game(1, in_memory_repo) == 3
     assert games_services.calculate_average_rating_for_game(2, in_memory_repo) == 3
 
+# Test the average rating and rating distribution come from the game's running rating aggregates
+def test_rating_summary_for_game(in_memory_repo):
+    user = User("reviewer", "TestPassword9")
+    game = in_memory_repo.get_game(4)
+
+    assert games_services.calculate_average_rating_for_game(4, in_memory_repo) is None
+
+    make_review("Good", 4, user, game)
+    make_review("Okay", 3, user, game)
+
+    assert games_services.calculate_average_rating_for_game(4, in_memory_repo) == 4
+    distribution = games_services.get_rating_distribution_for_game(4, in_memory_repo)
+    assert [rating['rating'] for rating in distribution] == [5, 4, 3, 2, 1, 0]
+    assert [rating['count'] for rating in distribution] == [0, 1, 1, 0, 0, 0]
+
 # Test game services correctly picks up if a game is already in user favourites
 def test_is_game_already_favourited(in_memory_repo):
     user = in_memory_repo.get_user("jess")
@@ -229,6 +260,19 @@ def test_get_user_favourites(in_memory_repo):
     favourites = profile_services.get_user_favourites(user.username, in_memory_repo)
     assert len(favourites) == 0
 
+# Test a single page of a user's favourites can be retrieved, in the order they were favourited
+def test_get_user_favourites_for_page(in_memory_repo):
+    user = User("favouriter", "TestPassword9")
+    in_memory_repo.add_user(user)
+    for game_id in [4, 1, 7]:
+        in_memory_repo.add_game_to_favourites(user, in_memory_repo.get_game(game_id))
+
+    assert profile_services.get_number_of_user_favourites("favouriter", in_memory_repo) == 3
+
+    page = profile_services.get_user_favourites_for_page("favouriter", 2, 2, in_memory_repo)
+    assert [game.game_id for game in page] == [7]
+    assert profile_services.get_most_recent_favourite("favouriter", in_memory_repo).game_id == 7
+
 def test_get_user_reviews_unknown_user(in_memory_repo):
     username = "nonexistent_user"
     with pytest.raises(UnknownUserException):
@@ -425,6 +469,15 @@ def test_search_returns_None_for_nonexistent_game(in_memory_repo):
     assert search_services.get_game_from_title("Nonexistent game", in_memory_repo) is None
 
 
+# Test every game with a title starting with the search string can be retrieved
+def test_search_retrieves_games_with_a_title_prefix(in_memory_repo):
+    games = search_services.get_games_from_title("the", in_memory_repo)
+
+    assert len(games) == 1
+    assert games[0]["title"] == "The Stalin Subway: Red Veil"
+    assert search_services.get_games_from_title("Nonexistent game", in_memory_repo) == []
+
+
 # Test games can be retrieved from a publisher name
 def test_search_retrieves_games_from_a_specific_publisher(in_memory_repo):
     games = search_services.get_games_for_publisher("Activision", in_memory_repo)
@@ -441,21 +494,17 @@ def test_search_returns_empty_list_for_not_found_publisher(in_memory_repo):
     assert len(games) == 0
 
 
-# Test games can be filtered by publisher
-def test_games_can_be_filtered_by_publisher(in_memory_repo):
-    all_games = genres_services.get_games_for_genre("Action", in_memory_repo)
-
-    filtered_games = search_services.filter_games_by_publisher("Activision", all_games)
+# Test search results can be filtered by publisher
+def test_search_results_can_be_filtered_by_publisher(in_memory_repo):
+    filtered_games = search_services.search(SearchRequest("action", publisher="Activision"), in_memory_repo)
 
     assert len(filtered_games) == 1
     assert filtered_games[0].get('publisher') == "Activision"
     assert filtered_games[0].get('title') == "Call of Duty® 4: Modern Warfare®"
 
-# Test games can be filtered by price
-def test_games_can_be_filtered_by_price(in_memory_repo):
-    all_games = genres_services.get_games_for_genre("Action", in_memory_repo)
-
-    filtered_games = search_services.filter_games_by_price("10.00", all_games)
+# Test search results can be filtered by price
+def test_search_results_can_be_filtered_by_price(in_memory_repo):
+    filtered_games = search_services.search(SearchRequest("action", price_max=10.00), in_memory_repo)
 
     assert len(filtered_games) == 5
 
@@ -463,29 +512,24 @@ def test_games_can_be_filtered_by_price(in_memory_repo):
         assert game['price'] <= 10.00
 
 # Test an invalid price (one that can't be converted to float) raises a search key error
-def test_invalid_price_raises_error(in_memory_repo):
-    all_games = games_services.get_games(in_memory_repo)
-
+def test_invalid_price_raises_error():
     with pytest.raises(NonExistentSearchKeyException) as excinfo:
-        search_services.filter_games_by_price("invalid", all_games)
+        search_services.parse_price("invalid")
 
-        assert excinfo == "invalid is not a valid price. Please input a number greater than 0."
+    assert str(excinfo.value) == "invalid is not a valid price. Please input a number greater than 0."
 
 # Test a negative price raises a search key error
-def test_negative_price_raises_error(in_memory_repo):
-    all_games = games_services.get_games(in_memory_repo)
-
+def test_negative_price_raises_error():
     with pytest.raises(NonExistentSearchKeyException) as excinfo:
-        search_services.filter_games_by_price("-1", all_games)
-
-        assert excinfo == "-1 is not a valid price. Please input a number greater than 0."
+        search_services.parse_price("-1")
 
-# Test games can be filtered by genres
-def test_games_can_be_filtered_by_genre(in_memory_repo):
-    all_games = games_services.get_games(in_memory_repo)
+    assert str(excinfo.value) == "-1 is not a valid price. Please input a number greater than 0."
+    assert search_services.parse_price("10.00") == 10.0
 
+# Test search results can be filtered by genres
+def test_search_results_can_be_filtered_by_genre(in_memory_repo):
     # Filter by action
-    action_games = search_services.filter_games_by_genre(["action"], all_games)
+    action_games = search_services.search(SearchRequest("action", genres=["action"]), in_memory_repo)
 
     assert len(action_games) == 10
 
@@ -493,7 +537,7 @@ def test_games_can_be_filtered_by_genre(in_memory_repo):
         assert "Action" in game['genres']
 
     # Filter by a few categories
-    filtered_games = search_services.filter_games_by_genre(["Simulation", "indie"], all_games)
+    filtered_games = search_services.search(SearchRequest("action", genres=["Simulation", "indie"]), in_memory_repo)
 
     assert len(filtered_games) == 1
 
@@ -525,6 +569,64 @@ def test_games_can_be_retrieved_from_search_query(in_memory_repo):
         assert len(result) == 10
 
 
+# Test search matches words in game descriptions, with the most relevant games first
+def test_search_query_matches_game_descriptions(in_memory_repo):
+    with app.test_request_context('search?term=princess', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+
+        assert [game['game_id'] for game in result] == [5]
+
+    # Games found by full-text search aren't repeated by the publisher, genre and title matches
+    with app.test_request_context('search?term=action', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+
+        assert len({game['game_id'] for game in result}) == len(result) == 10
+
+# Test the filters are applied to the games matching the search term
+def test_search_query_filters_games(in_memory_repo):
+    with app.test_request_context('search?term=action&price_max=10&genres=Indie&genres=Simulation', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+
+        assert [game['game_id'] for game in result] == [10]
+
+    with app.test_request_context('search?term=action&publisher=activision', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+
+        assert [game['publisher'] for game in result] == ["Activision"]
+
+    with app.test_request_context('search?term=action&genres=Indie&genres=Action&genre_match=all', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+
+        assert [game['game_id'] for game in result] == [10]
+
+    with app.test_request_context('search?term=action&genre_match=some', method='GET'):
+        with pytest.raises(NonExistentSearchKeyException):
+            search_services.get_games_from_search_query(request, in_memory_repo)
+
+    # An invalid price is reported even without a term
+    with app.test_request_context('search?price_max=-1', method='GET'):
+        with pytest.raises(NonExistentSearchKeyException):
+            search_services.get_games_from_search_query(request, in_memory_repo)
+
+# Test the search results are counted for each filter option
+def test_search_facets_count_results(in_memory_repo):
+    with app.test_request_context('search?term=action&price_max=10', method='GET'):
+        result = search_services.get_games_from_search_query(request, in_memory_repo)
+        facets = search_services.get_search_facets(result, in_memory_repo)
+
+    assert facets['genres'][0] == {'genre_name': 'Action', 'count': 5}
+    assert sum(publisher['count'] for publisher in facets['publishers']) == 5
+    assert facets['prices'] == [{'price_max': 0.0, 'label': 'Free', 'count': 1},
+                                {'price_max': 10.0, 'label': '$0.01 - $10.00', 'count': 4}]
+    assert search_services.price_bucket_label(None) == 'Over $70.00'
+
+# Test games found by full-text search come with an escaped snippet of their description highlighting the search words
+def test_search_highlights_matching_words_in_snippets(in_memory_repo):
+    game = search_services.search_games("princess", in_memory_repo)[0]
+
+    assert '<mark>princess</mark>' in game['snippet'].lower()
+    assert search_services.highlight_snippet('<b>\x02a\x03</b>') == '&lt;b&gt;<mark>a</mark>&lt;/b&gt;'
+
 # Test an invalid search key throws an exception
 def test_a_nonexistent_search_key_throws_an_error(in_memory_repo):
     with app.test_request_context('search?notasearchkey=notasearchkey', method='GET'):